@@ -1,4 +1,8 @@
 import importlib
+import os
+import threading
+from contextlib import contextmanager
+from time import sleep
 from typing import Optional
 
 from django.core.cache import InvalidCacheBackendError, caches
@@ -7,6 +11,9 @@ from django_q.conf import Conf
 
 
 class Broker:
+    # whether one instance can be used by several threads at once, see get_shared_broker
+    thread_safe = True
+
     def __init__(self, list_key: str = Conf.PREFIX):
         self.connection = self.get_connection(list_key)
         self.list_key = list_key
@@ -29,6 +36,16 @@ class Broker:
         """
         pass
 
+    def enqueue_many(self, tasks: list) -> list:
+        """
+        Puts a batch of tasks onto the queue
+        Brokers that support batch writes should override this.
+        Raises an error when a task can't be queued, instead of leaving it out.
+        :type tasks: list
+        :return: list of task ids, one for each task
+        """
+        return [self.enqueue(task) for task in tasks]
+
     def dequeue(self):
         """
         Gets a task from the queue
@@ -73,6 +90,13 @@ class Broker:
         """
         pass
 
+    def flush(self):
+        """
+        Sends acknowledgements the broker has buffered
+        Brokers that batch acknowledgements should override this.
+        """
+        pass
+
     def fail(self, task_id):
         """
         Fails a task message
@@ -80,6 +104,31 @@ class Broker:
         :return:
         """
 
+    def notify(self, keys: list):
+        """
+        Tells callers waiting in result() or fetch() that tasks finished
+        Brokers that can push notifications should override this and listen.
+        :param keys: the ids, names and groups of the finished tasks
+        """
+        pass
+
+    @contextmanager
+    def listen(self, key: str):
+        """
+        Subscribes to notifications for a task id, name or group
+        Yields a function that blocks until a notification arrives or timeout seconds have passed.
+        Without notifications it waits 10 milliseconds, so the caller keeps polling.
+        :param key: the task id, name or group
+        """
+        yield lambda timeout: sleep(min(timeout, 0.01))
+
+    def requeue_expired(self):
+        """
+        Puts tasks that weren't acknowledged in time back on the queue.
+        Only needed on brokers that don't redeliver tasks by themselves.
+        """
+        pass
+
     def ping(self) -> bool:
         """
         Checks whether the broker connection is available
@@ -167,39 +216,84 @@ def get_broker(list_key: str = Conf.PREFIX) -> Broker:
     :type list_key: str
     :return: a broker instance
     """
+    return get_broker_class()(list_key=list_key)
+
+
+def get_shared_broker(list_key: str = Conf.PREFIX) -> Broker:
+    """
+    Gets a broker instance that is reused for the lifetime of the current process.
+    Instances are keyed by queue name and broker type and are never shared with forked processes.
+    Brokers that aren't thread safe get an instance for each thread.
+    :param list_key: optional queue name
+    :type list_key: str
+    :return: a broker instance
+    """
+    global _brokers_pid
+    if _brokers_pid != os.getpid():
+        # don't reuse connections inherited from a parent process
+        _brokers.clear()
+        _brokers_pid = os.getpid()
+    broker_class = get_broker_class()
+    key = (list_key, broker_class)
+    if not broker_class.thread_safe:
+        key += (threading.get_ident(),)
+    if key not in _brokers:
+        _brokers[key] = broker_class(list_key=list_key)
+    return _brokers[key]
+
+
+def get_broker_class() -> type:
+    """
+    Gets the configured broker class
+    :return: a Broker class
+    """
     # custom
     if Conf.BROKER_CLASS:
         module, func = Conf.BROKER_CLASS.rsplit(".", 1)
         m = importlib.import_module(module)
-        broker = getattr(m, func)
-        return broker(list_key=list_key)
+        return getattr(m, func)
     # disque
     elif Conf.DISQUE_NODES:
         from django_q.brokers import disque
 
-        return disque.Disque(list_key=list_key)
+        return disque.Disque
     # Iron MQ
     elif Conf.IRON_MQ:
         from django_q.brokers import ironmq
 
-        return ironmq.IronMQBroker(list_key=list_key)
+        return ironmq.IronMQBroker
     # SQS
     elif type(Conf.SQS) == dict:
         from django_q.brokers import aws_sqs
 
-        return aws_sqs.Sqs(list_key=list_key)
+        return aws_sqs.Sqs
     # ORM
     elif Conf.ORM:
         from django_q.brokers import orm
 
-        return orm.ORM(list_key=list_key)
+        return orm.ORM
+    # SQLite
+    elif Conf.SQLITE:
+        from django_q.brokers import sqlite
+
+        return sqlite.SQLite
     # Mongo
     elif Conf.MONGO:
         from django_q.brokers import mongo
 
-        return mongo.Mongo(list_key=list_key)
+        return mongo.Mongo
+    # Redis streams
+    elif Conf.REDIS_STREAMS:
+        from django_q.brokers import redis_streams
+
+        return redis_streams.RedisStreams
     # default to redis
     else:
         from django_q.brokers import redis_broker
 
-        return redis_broker.Redis(list_key=list_key)
+        return redis_broker.Redis
+
+
+# broker instances of the current process, see get_shared_broker
+_brokers = {}
+_brokers_pid = None
@@ -1,27 +1,110 @@
+from time import time
+
 from boto3 import Session
 from botocore.client import ClientError
 
 from django_q.brokers import Broker
-from django_q.conf import Conf
+from django_q.conf import Conf, logger
 
 QUEUE_DOES_NOT_EXIST = "AWS.SimpleQueueService.NonExistentQueue"
 
+# sqs batch limits
+BATCH_SIZE = 10
+BATCH_BYTES = 262144
+
+# seconds to reuse the queue attributes for the queue metrics
+ATTRIBUTES_TTL = 5
+
+# number of times a batch is sent while SQS fails some of its messages
+SEND_ATTEMPTS = 3
+
+
+def _batches(tasks: list):
+    """
+    Splits tasks into batches that fit within the SQS batch limits
+    """
+    batch = []
+    size = 0
+    for task in tasks:
+        task_size = len(task.encode())
+        if batch and (len(batch) == BATCH_SIZE or size + task_size > BATCH_BYTES):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(task)
+        size += task_size
+    if batch:
+        yield batch
+
 
 class Sqs(Broker):
+    # boto3 resources and the acknowledgement buffer can't be shared between threads
+    thread_safe = False
+
     def __init__(self, list_key: str = Conf.PREFIX):
         self.sqs = None
         super(Sqs, self).__init__(list_key)
         self.queue = self.get_queue()
+        self._acks = []
+        self._acks_since = None
+        self._attributes = None
+        self._attributes_at = 0
 
     def __setstate__(self, state):
         super(Sqs, self).__setstate__(state)
         self.sqs = None
         self.queue = self.get_queue()
+        self._acks = []
+        self._acks_since = None
+        self._attributes = None
+        self._attributes_at = 0
 
     def enqueue(self, task):
         response = self.queue.send_message(MessageBody=task)
         return response.get("MessageId")
 
+    def enqueue_many(self, tasks: list) -> list:
+        ids = []
+        for batch in _batches(tasks):
+            ids += self._send_batch(batch)
+        return ids
+
+    def _send_batch(self, batch: list) -> list:
+        """
+        Sends a batch and retries the messages SQS failed to queue.
+        Raises a ClientError when messages still fail, or when SQS blames the message itself.
+        """
+        ids = [None] * len(batch)
+        pending = list(range(len(batch)))
+        for _ in range(SEND_ATTEMPTS):
+            response = self.queue.send_messages(
+                Entries=[{"Id": str(i), "MessageBody": batch[i]} for i in pending]
+            )
+            for successful in response.get("Successful", []):
+                ids[int(successful["Id"])] = successful["MessageId"]
+            failed = response.get("Failed", [])
+            if not failed:
+                return ids
+            for f in failed:
+                logger.warning(
+                    f"SQS failed to enqueue a task: {f.get('Message', f['Code'])}"
+                )
+            # sending the same message again won't help
+            if any(f.get("SenderFault") for f in failed):
+                break
+            pending = [int(f["Id"]) for f in failed]
+        queued = len([i for i in ids if i])
+        raise ClientError(
+            {
+                "Error": {
+                    "Code": failed[0]["Code"],
+                    "Message": f"{len(failed)} tasks failed, {queued} of the batch "
+                    f"were queued: {failed[0].get('Message', '')}",
+                }
+            },
+            "SendMessageBatch",
+        )
+
     def dequeue(self):
         # sqs supports max 10 messages in bulk
         if Conf.BULK > 10:
@@ -48,25 +131,67 @@ class Sqs(Broker):
             return [(t.receipt_handle, t.body) for t in tasks]
 
     def acknowledge(self, task_id):
-        return self.delete(task_id)
+        # buffer receipts and delete them in batches
+        if not self._acks:
+            self._acks_since = time()
+        self._acks.append(task_id)
+        if (
+            len(self._acks) >= BATCH_SIZE
+            or time() - self._acks_since >= Conf.FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self):
+        acks, self._acks = self._acks, []
+        for i in range(0, len(acks), BATCH_SIZE):
+            self._delete_batch(acks[i : i + BATCH_SIZE])
+
+    def _delete_batch(self, receipt_handles: list):
+        response = self.queue.delete_messages(
+            Entries=[
+                {"Id": str(i), "ReceiptHandle": handle}
+                for i, handle in enumerate(receipt_handles)
+            ]
+        )
+        for failed in response.get("Failed", []):
+            logger.error(
+                f"SQS failed to delete a task: {failed.get('Message', failed['Code'])}"
+            )
+
+    def get_attributes(self) -> dict:
+        """
+        Gets the queue attributes, reusing them for ATTRIBUTES_TTL seconds
+        """
+        if not self._attributes or time() - self._attributes_at > ATTRIBUTES_TTL:
+            self._attributes = self.sqs.meta.client.get_queue_attributes(
+                QueueUrl=self.queue.url,
+                AttributeNames=[
+                    "ApproximateNumberOfMessages",
+                    "ApproximateNumberOfMessagesNotVisible",
+                ],
+            )["Attributes"]
+            self._attributes_at = time()
+        return self._attributes
 
     def queue_size(self) -> int:
-        return int(self.queue.attributes["ApproximateNumberOfMessages"])
+        return int(self.get_attributes()["ApproximateNumberOfMessages"])
 
     def lock_size(self) -> int:
-        return int(self.queue.attributes["ApproximateNumberOfMessagesNotVisible"])
+        return int(self.get_attributes()["ApproximateNumberOfMessagesNotVisible"])
 
     def delete(self, task_id):
-        message = self.sqs.Message(self.queue.url, task_id)
-        message.delete()
+        self._delete_batch([task_id])
 
     def fail(self, task_id):
+        # the pusher fails bad packages and never flushes, so don't buffer these
         self.delete(task_id)
 
     def delete_queue(self):
+        self._acks = []
         self.queue.delete()
 
     def purge_queue(self):
+        self._acks = []
         self.queue.purge()
 
     def ping(self) -> bool:
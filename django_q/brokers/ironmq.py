@@ -9,6 +9,13 @@ class IronMQBroker(Broker):
     def enqueue(self, task):
         return self.connection.post(task)["ids"][0]
 
+    def enqueue_many(self, tasks: list) -> list:
+        ids = []
+        # ironmq accepts up to 100 messages per post
+        for i in range(0, len(tasks), 100):
+            ids += self.connection.post(*tasks[i : i + 100])["ids"]
+        return ids
+
     def dequeue(self):
         timeout = Conf.RETRY or None
         tasks = self.connection.get(timeout=timeout, wait=1, max=Conf.BULK)["messages"]
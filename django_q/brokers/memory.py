@@ -0,0 +1,202 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from itertools import count
+from multiprocessing.managers import BaseManager
+from time import time
+
+from django_q.brokers import Broker
+from django_q.conf import Conf
+
+
+class MemoryQueue:
+    """
+    Queue state that lives in the manager process and is shared by all cluster processes.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.ids = count(1)
+        self.waiting = deque()
+        self.payloads = {}
+        self.deadlines = {}
+        # listener and notification counts for each key with listeners
+        self.finished = threading.Condition()
+        self.listeners = {}
+
+    def enqueue(self, task) -> int:
+        with self.condition:
+            task_id = next(self.ids)
+            self.payloads[task_id] = task
+            self.waiting.append(task_id)
+            self.condition.notify()
+        return task_id
+
+    def enqueue_many(self, tasks: list) -> list:
+        with self.condition:
+            task_ids = []
+            for task in tasks:
+                task_id = next(self.ids)
+                self.payloads[task_id] = task
+                self.waiting.append(task_id)
+                task_ids.append(task_id)
+            self.condition.notify_all()
+        return task_ids
+
+    def dequeue(self, bulk: int, retry: int, timeout: float) -> list:
+        with self.condition:
+            self.requeue_expired()
+            if not self.waiting:
+                self.condition.wait(timeout)
+            tasks = []
+            while self.waiting and len(tasks) < bulk:
+                task_id = self.waiting.popleft()
+                # skip deleted tasks
+                if task_id in self.payloads:
+                    self.deadlines[task_id] = time() + retry
+                    tasks.append((task_id, self.payloads[task_id]))
+            return tasks
+
+    def requeue_expired(self):
+        now = time()
+        expired = [i for i, deadline in self.deadlines.items() if deadline <= now]
+        for task_id in sorted(expired, reverse=True):
+            del self.deadlines[task_id]
+            self.waiting.appendleft(task_id)
+
+    def delete(self, task_id):
+        with self.condition:
+            self.payloads.pop(task_id, None)
+            self.deadlines.pop(task_id, None)
+
+    def queue_size(self) -> int:
+        with self.condition:
+            self.requeue_expired()
+            return len(self.payloads) - len(self.deadlines)
+
+    def lock_size(self) -> int:
+        with self.condition:
+            self.requeue_expired()
+            return len(self.deadlines)
+
+    def subscribe(self, key: str) -> int:
+        with self.finished:
+            counts = self.listeners.setdefault(key, [0, 0])
+            counts[0] += 1
+            return counts[1]
+
+    def unsubscribe(self, key: str):
+        with self.finished:
+            counts = self.listeners[key]
+            counts[0] -= 1
+            if not counts[0]:
+                del self.listeners[key]
+
+    def notify(self, keys: list):
+        with self.finished:
+            for key in keys:
+                if key in self.listeners:
+                    self.listeners[key][1] += 1
+            self.finished.notify_all()
+
+    def wait(self, key: str, seen: int, timeout: float) -> int:
+        with self.finished:
+            counts = self.listeners[key]
+            self.finished.wait_for(lambda: counts[1] > seen, timeout)
+            return counts[1]
+
+    def purge(self):
+        with self.condition:
+            self.waiting.clear()
+            self.payloads.clear()
+            self.deadlines.clear()
+
+
+class MemoryManager(BaseManager):
+    pass
+
+
+MemoryManager.register("MemoryQueue", MemoryQueue)
+
+# the manager and queues started by this process
+_manager = None
+_queues = {}
+
+
+class Memory(Broker):
+    """
+    Keeps the queue in a multiprocessing manager, so a cluster can run without an external service.
+    Only processes that share the broker instance, like the ones started by a Cluster, see the same queue.
+    """
+
+    def __getstate__(self):
+        # pass the queue proxy on to the cluster processes
+        return self.list_key, self._info, self.connection
+
+    def __setstate__(self, state):
+        self.list_key, self._info, self.connection = state
+        self.cache = self.get_cache()
+
+    def enqueue(self, task):
+        return self.connection.enqueue(task)
+
+    def enqueue_many(self, tasks: list) -> list:
+        return self.connection.enqueue_many(tasks)
+
+    def dequeue(self):
+        tasks = self.connection.dequeue(Conf.BULK, Conf.RETRY, 1)
+        if tasks:
+            return tasks
+
+    def acknowledge(self, task_id):
+        return self.delete(task_id)
+
+    def fail(self, task_id):
+        return self.delete(task_id)
+
+    def delete(self, task_id):
+        self.connection.delete(task_id)
+
+    def queue_size(self) -> int:
+        return self.connection.queue_size()
+
+    def lock_size(self) -> int:
+        return self.connection.lock_size()
+
+    def purge_queue(self):
+        self.connection.purge()
+
+    def delete_queue(self):
+        self.connection.purge()
+
+    def notify(self, keys: list):
+        self.connection.notify(keys)
+
+    @contextmanager
+    def listen(self, key: str):
+        seen = self.connection.subscribe(key)
+
+        def wait(timeout: float):
+            nonlocal seen
+            seen = self.connection.wait(key, seen, timeout)
+
+        try:
+            yield wait
+        finally:
+            self.connection.unsubscribe(key)
+
+    def ping(self) -> bool:
+        return True
+
+    def info(self) -> str:
+        return "Memory"
+
+    @staticmethod
+    def get_connection(list_key: str = Conf.PREFIX):
+        global _manager
+        if list_key not in _queues:
+            if _manager is None:
+                _manager = MemoryManager()
+                _manager.start()
+            _queues[list_key] = _manager.MemoryQueue()
+        return _queues[list_key]
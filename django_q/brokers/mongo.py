@@ -3,11 +3,11 @@ from time import sleep
 
 from bson import ObjectId
 from django.utils import timezone
-from pymongo import MongoClient
-from pymongo.errors import ConfigurationError
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import ConfigurationError, OperationFailure, PyMongoError
 
 from django_q.brokers import Broker
-from django_q.conf import Conf
+from django_q.conf import Conf, logger
 
 
 def _timeout():
@@ -18,10 +18,14 @@ class Mongo(Broker):
     def __init__(self, list_key=Conf.PREFIX):
         super(Mongo, self).__init__(list_key)
         self.collection = self.get_collection()
+        self._stream = None
+        self._watch = True
 
     def __setstate__(self, state):
         super(Mongo, self).__setstate__(state)
         self.collection = self.get_collection()
+        self._stream = None
+        self._watch = True
 
     @staticmethod
     def get_connection(list_key: str = Conf.PREFIX) -> MongoClient:
@@ -33,7 +37,15 @@ class Mongo(Broker):
                 Conf.MONGO_DB = self.connection.get_default_database().name
             except ConfigurationError:
                 Conf.MONGO_DB = "django-q"
-        return self.connection[Conf.MONGO_DB][self.list_key]
+        collection = self.connection[Conf.MONGO_DB][self.list_key]
+        self.create_indexes(collection)
+        return collection
+
+    @staticmethod
+    def create_indexes(collection):
+        # claims and queue metrics all filter on the lock
+        collection.create_index([("lock", ASCENDING)])
+        collection.create_index([("claim", ASCENDING)], sparse=True)
 
     def queue_size(self):
         return self.collection.count_documents({"lock": {"$lte": _timeout()}})
@@ -61,17 +73,93 @@ class Mongo(Broker):
         ).inserted_id
         return str(inserted_id)
 
+    def enqueue_many(self, tasks: list) -> list:
+        # insert_many refuses an empty list
+        if not tasks:
+            return []
+        inserted_ids = self.collection.insert_many(
+            [{"payload": task, "lock": _timeout()} for task in tasks]
+        ).inserted_ids
+        return [str(inserted_id) for inserted_id in inserted_ids]
+
     def dequeue(self):
-        task = self.collection.find_one_and_update(
-            {"lock": {"$lte": _timeout()}}, {"$set": {"lock": timezone.now()}}
+        if Conf.BULK > 1:
+            tasks = self._claim_many()
+        else:
+            task = self.collection.find_one_and_update(
+                {"lock": {"$lte": _timeout()}}, {"$set": {"lock": timezone.now()}}
+            )
+            tasks = [(str(task["_id"]), task["payload"])] if task else []
+        if tasks:
+            return tasks
+        # empty queue, wait for an insert or spare the cpu
+        if self._watch:
+            self._wait()
+        else:
+            sleep(Conf.POLL)
+
+    def _wait(self, timeout: float = 1):
+        """
+        Blocks until a task is inserted in the queue collection or the timeout expires.
+        Falls back to polling when the deployment doesn't support change streams.
+        """
+        try:
+            if not (self._stream and self._stream.alive):
+                # keep the stream open, so inserts between claims still wake us up
+                self._stream = self.collection.watch(
+                    [{"$match": {"operationType": "insert"}}],
+                    max_await_time_ms=int(timeout * 1000),
+                )
+            self._stream.try_next()
+        except OperationFailure as e:
+            # change streams need a replica set or sharded cluster
+            logger.info(f"MongoDB change streams unavailable, polling instead: {e}")
+            self._close_stream()
+            self._watch = False
+            sleep(Conf.POLL)
+        except PyMongoError as e:
+            logger.warning(f"MongoDB change stream failed: {e}")
+            self._close_stream()
+            sleep(Conf.POLL)
+
+    def _close_stream(self):
+        if self._stream:
+            try:
+                self._stream.close()
+            except PyMongoError:
+                pass
+            self._stream = None
+
+    def _claim_many(self) -> list:
+        """
+        Stamps a batch of tasks with a claim token and fetches them by that token.
+        Tasks claimed by another cluster in the meantime no longer match the lock and are skipped.
+        """
+        timeout = _timeout()
+        ids = [
+            task["_id"]
+            for task in self.collection.find({"lock": {"$lte": timeout}}, {"_id": 1})
+            .sort("lock", ASCENDING)
+            .limit(Conf.BULK)
+        ]
+        if not ids:
+            return []
+        claim = ObjectId()
+        self.collection.update_many(
+            {"_id": {"$in": ids}, "lock": {"$lte": timeout}},
+            {"$set": {"lock": timezone.now(), "claim": claim}},
         )
-        if task:
-            return [(str(task["_id"]), task["payload"])]
-        # empty queue, spare the cpu
-        sleep(Conf.POLL)
+        return [
+            (str(task["_id"]), task["payload"])
+            for task in self.collection.find({"claim": claim}).sort("_id", ASCENDING)
+        ]
 
     def delete_queue(self):
-        return self.collection.drop()
+        self._close_stream()
+        result = self.collection.drop()
+        # dropping the collection removes its indexes as well
+        self.create_indexes(self.collection)
+        return result
 
     def delete(self, task_id):
         self.collection.delete_one({"_id": ObjectId(task_id)})
@@ -1,8 +1,10 @@
+import select
+from contextlib import contextmanager
 from datetime import timedelta
 from time import sleep
 
 from django import db
-from django.db import transaction
+from django.db import connections, transaction
 from django.utils import timezone
 
 from django_q.brokers import Broker
@@ -14,7 +16,14 @@ def _timeout():
     return timezone.now() - timedelta(seconds=Conf.RETRY)
 
 
+def _use_notify() -> bool:
+    return Conf.ORM_NOTIFY and connections[Conf.ORM].vendor == "postgresql"
+
+
 class ORM(Broker):
+    # the database connection we are currently listening on
+    _listener = None
+
     @staticmethod
     def get_connection(list_key: str = Conf.PREFIX):
         if transaction.get_autocommit(
@@ -58,25 +67,139 @@ class ORM(Broker):
         package = self.get_connection().create(
             key=self.list_key, payload=task, lock=_timeout()
         )
+        if _use_notify():
+            with connections[Conf.ORM].cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, '')", [self.channel])
         return package.pk
 
+    def enqueue_many(self, tasks: list) -> list:
+        packages = self.get_connection().bulk_create(
+            [OrmQ(key=self.list_key, payload=task, lock=_timeout()) for task in tasks],
+            batch_size=1000,
+        )
+        if _use_notify():
+            with connections[Conf.ORM].cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, '')", [self.channel])
+        # primary keys are only returned by some databases
+        return [package.pk for package in packages]
+
     def dequeue(self):
-        tasks = self.get_connection().filter(key=self.list_key, lock__lt=_timeout())[
-            0 : Conf.BULK
-        ]
-        if tasks:
-            task_list = []
-            for task in tasks:
-                if (
-                    self.get_connection()
-                    .filter(id=task.id, lock=task.lock)
-                    .update(lock=timezone.now())
-                ):
-                    task_list.append((task.pk, task.payload))
-                # else don't process, as another cluster has been faster than us on that task
+        if connections[Conf.ORM].features.has_select_for_update_skip_locked:
+            task_list = self._claim_skip_locked()
+        else:
+            task_list = self._claim()
+        if task_list:
             return task_list
-        # empty queue, spare the cpu
-        sleep(Conf.POLL)
+        # empty queue, wait for a notification or spare the cpu
+        if _use_notify():
+            self._wait()
+        else:
+            sleep(Conf.POLL)
+
+    @property
+    def channel(self) -> str:
+        # postgres truncates identifiers to 63 bytes
+        return f"django_q:{self.list_key}"[:63]
+
+    def _wait(self, timeout: float = 1):
+        """
+        Blocks until a task is enqueued on this queue or the timeout expires.
+        """
+        connection = connections[Conf.ORM]
+        connection.ensure_connection()
+        pg = connection.connection
+        if self._listener is not pg:
+            # new or recycled connection, (re)start listening
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {connection.ops.quote_name(self.channel)}")
+            self._listener = pg
+            # with CONN_MAX_AGE 0 this is a new connection on every poll, so check for
+            # tasks that were enqueued before it listened. get_connection would close it.
+            if (
+                OrmQ.objects.using(Conf.ORM)
+                .filter(key=self.list_key, lock__lt=_timeout())
+                .exists()
+            ):
+                return
+        # notifications read during the last commit are already in pg.notifies
+        if pg.notifies or select.select([pg], [], [], timeout)[0]:
+            pg.poll()
+            pg.notifies.clear()
+
+    def result_channel(self, key: str) -> str:
+        return f"django_q:{self.list_key}:done:{key}"[:63]
+
+    def notify(self, keys: list):
+        if not _use_notify():
+            return
+        channels = [self.result_channel(key) for key in keys]
+        if not channels:
+            return
+        # notify every channel with a single statement
+        with connections[Conf.ORM].cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(c, '') FROM unnest(%s::text[]) c", [channels]
+            )
+
+    @contextmanager
+    def listen(self, key: str):
+        # LISTEN only takes effect when the transaction commits
+        if not _use_notify() or not transaction.get_autocommit(using=Conf.ORM):
+            with super().listen(key) as wait:
+                yield wait
+            return
+        connection = connections[Conf.ORM]
+        channel = connection.ops.quote_name(self.result_channel(key))
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {channel}")
+        pg = connection.connection
+
+        def wait(timeout: float):
+            if pg.notifies or select.select([pg], [], [], timeout)[0]:
+                pg.poll()
+                pg.notifies.clear()
+
+        try:
+            yield wait
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"UNLISTEN {channel}")
+
+    def _claim_skip_locked(self) -> list:
+        """
+        Locks and stamps a batch of tasks in a single transaction.
+        Rows locked by other clusters are skipped instead of waited on.
+        """
+        queryset = self.get_connection()
+        with transaction.atomic(using=Conf.ORM):
+            tasks = list(
+                queryset.select_for_update(skip_locked=True)
+                .filter(key=self.list_key, lock__lt=_timeout())
+                .order_by("lock", "id")
+                .values_list("id", "payload")[0 : Conf.BULK]
+            )
+            if tasks:
+                queryset.filter(id__in=[t[0] for t in tasks]).update(
+                    lock=timezone.now()
+                )
+        return tasks
+
+    def _claim(self) -> list:
+        tasks = (
+            self.get_connection()
+            .filter(key=self.list_key, lock__lt=_timeout())
+            .order_by("lock", "id")[0 : Conf.BULK]
+        )
+        task_list = []
+        for task in tasks:
+            if (
+                self.get_connection()
+                .filter(id=task.id, lock=task.lock)
+                .update(lock=timezone.now())
+            ):
+                task_list.append((task.pk, task.payload))
+            # else don't process, as another cluster has been faster than us on that task
+        return task_list
 
     def delete_queue(self):
         return self.purge_queue()
@@ -1,3 +1,6 @@
+from contextlib import contextmanager
+from time import time
+
 import redis
 from redis import Redis
 
@@ -9,28 +12,262 @@ try:
 except ImportError:
     django_redis = None
 
+# maximum number of values sent with a single RPUSH
+PUSH_SIZE = 1000
+
+# maximum number of acknowledgements buffered before they are sent
+ACK_SIZE = 100
+
+# stores the payloads under new message ids and queues the ids
+ENQUEUE = """
+local last = redis.call('INCRBY', KEYS[3], #ARGV)
+local ids = {}
+for i, payload in ipairs(ARGV) do
+    local id = tostring(last - #ARGV + i)
+    redis.call('HSET', KEYS[2], id, payload)
+    ids[i] = id
+end
+redis.call('RPUSH', KEYS[1], unpack(ids))
+return ids
+"""
+
+# moves up to ARGV[2] message ids to the processing list, sets their deadline
+# and returns them with their payloads
+CLAIM = """
+local tasks = {}
+for i = 1, tonumber(ARGV[2]) do
+    local id = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+    if not id then
+        break
+    end
+    redis.call('ZADD', KEYS[3], ARGV[1], id)
+    tasks[#tasks + 1] = id
+    tasks[#tasks + 1] = redis.call('HGET', KEYS[4], id) or id
+end
+return tasks
+"""
+
+# puts tasks with an expired deadline back in front of the queue
+REQUEUE = """
+for _, task in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    if not redis.call('ZSCORE', KEYS[3], task) then
+        redis.call('ZADD', KEYS[3], ARGV[2], task)
+    end
+end
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+for _, task in ipairs(expired) do
+    redis.call('ZREM', KEYS[3], task)
+    if redis.call('LREM', KEYS[2], 1, task) > 0 then
+        redis.call('LPUSH', KEYS[1], task)
+    end
+end
+return #expired
+"""
+
 
 class Redis(Broker):
     def __init__(self, list_key: str = Conf.PREFIX):
         super(Redis, self).__init__(list_key=f"django_q:{list_key}:q")
+        self._acks = []
+        self._acks_since = None
+
+    def __setstate__(self, state):
+        super(Redis, self).__setstate__(state)
+        self._acks = []
+        self._acks_since = None
+
+    @property
+    def processing_key(self) -> str:
+        return f"{self.list_key}:processing"
+
+    @property
+    def deadline_key(self) -> str:
+        return f"{self.list_key}:deadlines"
+
+    @property
+    def payload_key(self) -> str:
+        return f"{self.list_key}:payloads"
+
+    @property
+    def id_key(self) -> str:
+        return f"{self.list_key}:ids"
 
     def enqueue(self, task):
+        if Conf.REDIS_RELIABLE:
+            return self.enqueue_many([task])[0]
         return self.connection.rpush(self.list_key, task)
 
+    def enqueue_many(self, tasks: list) -> list:
+        if Conf.REDIS_RELIABLE:
+            # queue short message ids, so acknowledging doesn't compare payloads
+            enqueue = self.connection.register_script(ENQUEUE)
+            task_ids = []
+            for i in range(0, len(tasks), PUSH_SIZE):
+                task_ids += enqueue(
+                    keys=[self.list_key, self.payload_key, self.id_key],
+                    args=tasks[i : i + PUSH_SIZE],
+                )
+            return task_ids
+        with self.connection.pipeline(transaction=False) as pipe:
+            chunks = [tasks[i : i + PUSH_SIZE] for i in range(0, len(tasks), PUSH_SIZE)]
+            for chunk in chunks:
+                pipe.rpush(self.list_key, *chunk)
+            lengths = pipe.execute()
+        # the list length after each push, like enqueue returns
+        return [
+            length - len(chunk) + i
+            for chunk, length in zip(chunks, lengths)
+            for i in range(1, len(chunk) + 1)
+        ]
+
     def dequeue(self):
+        if Conf.REDIS_RELIABLE:
+            return self._dequeue_reliable()
+        if Conf.BULK > 1:
+            # pop a batch in a single round trip
+            with self.connection.pipeline() as pipe:
+                pipe.lrange(self.list_key, 0, Conf.BULK - 1)
+                pipe.ltrim(self.list_key, Conf.BULK, -1)
+                tasks = pipe.execute()[0]
+            if tasks:
+                return [(None, task) for task in tasks]
+        # block until something arrives
         task = self.connection.blpop(self.list_key, 1)
         if task:
             return [(None, task[1])]
 
+    def _dequeue_reliable(self):
+        """
+        Moves message ids to the processing list, where they stay until they are acknowledged
+        or their deadline expires. The payloads are kept in a hash until then.
+        Tasks queued before reliable mode was enabled are their own id.
+        """
+        claim = self.connection.register_script(CLAIM)
+        claimed = claim(
+            keys=[
+                self.list_key,
+                self.processing_key,
+                self.deadline_key,
+                self.payload_key,
+            ],
+            args=[time() + Conf.RETRY, Conf.BULK],
+        )
+        if claimed:
+            return list(zip(claimed[::2], claimed[1::2]))
+        # empty queue, block until something arrives
+        task_id = self.connection.execute_command(
+            "BLMOVE", self.list_key, self.processing_key, "LEFT", "RIGHT", 1
+        )
+        if not task_id:
+            return
+        with self.connection.pipeline(transaction=False) as pipe:
+            pipe.zadd(self.deadline_key, {task_id: time() + Conf.RETRY})
+            pipe.hget(self.payload_key, task_id)
+            payload = pipe.execute()[1]
+        return [(task_id, payload or task_id)]
+
+    def acknowledge(self, task_id):
+        if not Conf.REDIS_RELIABLE or not task_id:
+            return
+        # buffer acknowledgements and send them in a single round trip
+        if not self._acks:
+            self._acks_since = time()
+        self._acks.append(task_id)
+        if (
+            len(self._acks) >= ACK_SIZE
+            or time() - self._acks_since >= Conf.FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self):
+        acks, self._acks = self._acks, []
+        if acks:
+            self._delete(acks)
+
+    def fail(self, task_id):
+        return self.delete(task_id)
+
+    def delete(self, task_id):
+        if not Conf.REDIS_RELIABLE or not task_id:
+            return
+        return self._delete([task_id])
+
+    def _delete(self, task_ids: list):
+        with self.connection.pipeline(transaction=False) as pipe:
+            for task_id in task_ids:
+                pipe.lrem(self.processing_key, 1, task_id)
+            pipe.zrem(self.deadline_key, *task_ids)
+            pipe.hdel(self.payload_key, *task_ids)
+            return pipe.execute()[0]
+
+    def requeue_expired(self):
+        if not Conf.REDIS_RELIABLE:
+            return
+        requeue = self.connection.register_script(REQUEUE)
+        now = time()
+        requeued = requeue(
+            keys=[self.list_key, self.processing_key, self.deadline_key],
+            args=[now, now + Conf.RETRY],
+        )
+        if requeued:
+            logger.warning(f"requeued {requeued} unacknowledged tasks")
+        return requeued
+
     def queue_size(self):
         return self.connection.llen(self.list_key)
 
+    def lock_size(self):
+        self.flush()
+        return self.connection.llen(self.processing_key)
+
     def delete_queue(self):
-        return self.connection.delete(self.list_key)
+        self._acks = []
+        return self.connection.delete(
+            self.list_key,
+            self.processing_key,
+            self.deadline_key,
+            self.payload_key,
+            self.id_key,
+        )
 
     def purge_queue(self):
+        if Conf.REDIS_RELIABLE:
+            with self.connection.pipeline() as pipe:
+                pipe.lrange(self.list_key, 0, -1)
+                pipe.ltrim(self.list_key, 1, 0)
+                task_ids = pipe.execute()[0]
+            if task_ids:
+                self.connection.hdel(self.payload_key, *task_ids)
+            return True
         return self.connection.ltrim(self.list_key, 1, 0)
 
+    def result_channel(self, key: str) -> str:
+        return f"{self.list_key}:done:{key}"
+
+    def notify(self, keys: list):
+        pipe = self.connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.publish(self.result_channel(key), 1)
+        pipe.execute()
+
+    @contextmanager
+    def listen(self, key: str):
+        pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.result_channel(key))
+
+        def wait(timeout: float):
+            deadline = time() + timeout
+            while True:
+                remaining = deadline - time()
+                # subscribe confirmations return None before the timeout
+                if remaining <= 0 or pubsub.get_message(timeout=remaining):
+                    return
+
+        try:
+            yield wait
+        finally:
+            pubsub.close()
+
     def ping(self) -> bool:
         try:
             return self.connection.ping()
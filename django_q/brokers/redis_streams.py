@@ -0,0 +1,128 @@
+import os
+import socket
+from time import time
+
+import redis
+
+from django_q.brokers import Broker
+from django_q.brokers.redis_broker import Redis
+from django_q.conf import Conf
+
+# consumer group shared by all clusters reading the stream
+GROUP = "django_q"
+
+
+class RedisStreams(Redis):
+    def __init__(self, list_key: str = Conf.PREFIX):
+        Broker.__init__(self, list_key=f"django_q:{list_key}:stream")
+        self._claimed_at = 0
+        self.create_group()
+
+    def __setstate__(self, state):
+        super(RedisStreams, self).__setstate__(state)
+        self._claimed_at = 0
+        self.create_group()
+
+    @property
+    def consumer(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def create_group(self):
+        try:
+            self.connection.xgroup_create(self.list_key, GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise e
+
+    def enqueue(self, task):
+        return self.connection.xadd(self.list_key, {"task": task})
+
+    def enqueue_many(self, tasks: list) -> list:
+        with self.connection.pipeline(transaction=False) as pipe:
+            for task in tasks:
+                pipe.xadd(self.list_key, {"task": task})
+            return pipe.execute()
+
+    def dequeue(self):
+        tasks = []
+        # take over tasks that other consumers didn't acknowledge in time
+        if time() - self._claimed_at >= 1:
+            self._claimed_at = time()
+            tasks = self.claim_expired()
+        if not tasks:
+            response = self.connection.xreadgroup(
+                GROUP,
+                self.consumer,
+                {self.list_key: ">"},
+                count=Conf.BULK,
+                block=1000,
+            )
+            if response:
+                tasks = response[0][1]
+        if tasks:
+            return [(task_id, fields[b"task"]) for task_id, fields in tasks]
+
+    def claim_expired(self) -> list:
+        """
+        Claims up to BULK pending tasks that have been idle longer than the retry time
+        :return: a list of stream entries
+        """
+        response = self.connection.execute_command(
+            "XAUTOCLAIM",
+            self.list_key,
+            GROUP,
+            self.consumer,
+            int(Conf.RETRY * 1000),
+            "0-0",
+            "COUNT",
+            Conf.BULK,
+        )
+        # deleted entries are returned as empty values
+        return [
+            (entry[0], dict(zip(entry[1][::2], entry[1][1::2])))
+            for entry in response[1]
+            if entry and entry[1]
+        ]
+
+    def acknowledge(self, task_id):
+        with self.connection.pipeline() as pipe:
+            pipe.xack(self.list_key, GROUP, task_id)
+            pipe.xdel(self.list_key, task_id)
+            return pipe.execute()[0]
+
+    def flush(self):
+        # acknowledgements are sent right away
+        pass
+
+    def fail(self, task_id):
+        return self.acknowledge(task_id)
+
+    def delete(self, task_id):
+        return self.acknowledge(task_id)
+
+    def requeue_expired(self):
+        pass
+
+    def queue_size(self) -> int:
+        # acknowledged tasks are deleted, so whatever isn't pending is waiting
+        with self.connection.pipeline(transaction=False) as pipe:
+            pipe.xlen(self.list_key)
+            pipe.xpending(self.list_key, GROUP)
+            length, pending = pipe.execute()
+        return length - pending["pending"]
+
+    def lock_size(self) -> int:
+        return self.connection.xpending(self.list_key, GROUP)["pending"]
+
+    def delete_queue(self):
+        return self.connection.delete(self.list_key)
+
+    def purge_queue(self):
+        self.delete_queue()
+        self.create_group()
+
+    def info(self) -> str:
+        if not self._info:
+            info = self.connection.info("server")
+            self._info = f"Redis Streams {info['redis_version']}"
+        return self._info
@@ -0,0 +1,181 @@
+import os
+import sqlite3
+import threading
+from time import sleep, time
+
+from django_q.brokers import Broker
+from django_q.conf import Conf
+
+# UPDATE ... RETURNING was added in SQLite 3.35
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# connections of the current thread, keyed by process id and database path
+_local = threading.local()
+
+
+def _timeout() -> float:
+    return time() - Conf.RETRY
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        path,
+        timeout=Conf.SQLITE_BUSY_TIMEOUT / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+    )
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS django_q_queue ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "key TEXT NOT NULL, "
+        "payload TEXT NOT NULL, "
+        "lock REAL NOT NULL)"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS django_q_queue_key_lock "
+        "ON django_q_queue (key, lock, id)"
+    )
+    return connection
+
+
+class SQLite(Broker):
+    """
+    Keeps the queue in a dedicated SQLite database in WAL mode.
+    Meant for clusters that run on a single host, without touching the application database.
+    """
+
+    @staticmethod
+    def get_connection(list_key: str = Conf.PREFIX) -> sqlite3.Connection:
+        # sqlite connections can't be shared with forked processes
+        key = (os.getpid(), Conf.SQLITE)
+        connections = _local.__dict__.setdefault("connections", {})
+        if key not in connections:
+            connections[key] = _connect(Conf.SQLITE)
+        return connections[key]
+
+    def enqueue(self, task):
+        cursor = self.get_connection().execute(
+            "INSERT INTO django_q_queue (key, payload, lock) VALUES (?, ?, 0)",
+            (self.list_key, task),
+        )
+        return cursor.lastrowid
+
+    def enqueue_many(self, tasks: list) -> list:
+        connection = self.get_connection()
+        task_ids = []
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for task in tasks:
+                cursor = connection.execute(
+                    "INSERT INTO django_q_queue (key, payload, lock) VALUES (?, ?, 0)",
+                    (self.list_key, task),
+                )
+                task_ids.append(cursor.lastrowid)
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return task_ids
+
+    def dequeue(self):
+        if HAS_RETURNING:
+            tasks = self._claim_returning()
+        else:
+            tasks = self._claim()
+        if tasks:
+            return tasks
+        # empty queue, spare the cpu
+        sleep(Conf.POLL)
+
+    def _claim_returning(self) -> list:
+        """
+        Stamps and returns a batch of tasks in a single statement.
+        """
+        tasks = (
+            self.get_connection()
+            .execute(
+                "UPDATE django_q_queue SET lock = ? WHERE id IN ("
+                "SELECT id FROM django_q_queue WHERE key = ? AND lock < ? "
+                "ORDER BY lock, id LIMIT ?) "
+                "RETURNING id, payload",
+                (time(), self.list_key, _timeout(), Conf.BULK),
+            )
+            .fetchall()
+        )
+        # returned rows are not ordered
+        return sorted(tasks)
+
+    def _claim(self) -> list:
+        """
+        Stamps and returns a batch of tasks for SQLite versions without RETURNING.
+        """
+        connection = self.get_connection()
+        # take the write lock up front, so no other cluster can claim the same tasks
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            tasks = connection.execute(
+                "SELECT id, payload FROM django_q_queue WHERE key = ? AND lock < ? "
+                "ORDER BY lock, id LIMIT ?",
+                (self.list_key, _timeout(), Conf.BULK),
+            ).fetchall()
+            if tasks:
+                connection.execute(
+                    "UPDATE django_q_queue SET lock = ? "
+                    f"WHERE id IN ({','.join('?' * len(tasks))})",
+                    [time()] + [task[0] for task in tasks],
+                )
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return tasks
+
+    def acknowledge(self, task_id):
+        return self.delete(task_id)
+
+    def fail(self, task_id):
+        self.delete(task_id)
+
+    def delete(self, task_id):
+        self.get_connection().execute(
+            "DELETE FROM django_q_queue WHERE id = ?", (task_id,)
+        )
+
+    def queue_size(self) -> int:
+        return (
+            self.get_connection()
+            .execute(
+                "SELECT COUNT(*) FROM django_q_queue WHERE key = ? AND lock < ?",
+                (self.list_key, _timeout()),
+            )
+            .fetchone()[0]
+        )
+
+    def lock_size(self) -> int:
+        return (
+            self.get_connection()
+            .execute(
+                "SELECT COUNT(*) FROM django_q_queue WHERE key = ? AND lock >= ?",
+                (self.list_key, _timeout()),
+            )
+            .fetchone()[0]
+        )
+
+    def purge_queue(self):
+        self.get_connection().execute(
+            "DELETE FROM django_q_queue WHERE key = ?", (self.list_key,)
+        )
+
+    def delete_queue(self):
+        return self.purge_queue()
+
+    def ping(self) -> bool:
+        self.get_connection().execute("SELECT 1")
+        return True
+
+    def info(self) -> str:
+        if not self._info:
+            self._info = f"SQLite {sqlite3.sqlite_version}"
+        return self._info
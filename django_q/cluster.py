@@ -1,14 +1,25 @@
 # Standard
 import ast
+import asyncio
+import gc
 import inspect
+import math
+import pickle
 import pydoc
+import queue
 import signal
 import socket
+import threading
 import traceback
 import uuid
-from datetime import datetime
-from multiprocessing import Event, Process, Value, current_process
-from time import sleep
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from multiprocessing import Array, Event, Process, Value, current_process
+from time import sleep, time
+from typing import Optional
 
 # External
 import arrow
@@ -25,12 +36,13 @@ except core.exceptions.AppRegistryNotReady:
     django.setup()
 
 from django.conf import settings
+from django.db.models.signals import post_save
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 # Local
 import django_q.tasks
-from django_q.brokers import Broker, get_broker
+from django_q.brokers import Broker, get_broker, get_shared_broker
 from django_q.conf import (
     Conf,
     croniter,
@@ -47,6 +59,9 @@ from django_q.signals import post_execute, pre_execute
 from django_q.signing import BadSignature, SignedPackage
 from django_q.status import Stat, Status
 
+# seconds the sentinel waits past the timeout before it kills a worker that times out its own tasks
+TIMEOUT_GRACE = 5
+
 
 class Cluster:
     def __init__(self, broker: Broker = None):
@@ -160,15 +175,30 @@ class Sentinel:
         self.task_queue = (
             Queue(maxsize=Conf.QUEUE_LIMIT) if Conf.QUEUE_LIMIT else Queue()
         )
-        self.result_queue = Queue()
+        # each monitor has its own result queue
+        self.result_queues = [Queue() for __ in range(Conf.MONITORS)]
         self.event_out = Event()
-        self.monitor = None
+        self.monitors = []
         self.pusher = None
         if start:
             self.start()
 
+    @property
+    def result_queue(self) -> Queue:
+        return self.result_queues[0]
+
+    @property
+    def monitor(self) -> Process:
+        return self.monitors[0] if self.monitors else None
+
     def start(self):
         self.broker.ping()
+        if Conf.PRELOAD:
+            # import once, so the workers inherit the modules instead of importing them again
+            preload()
+            if hasattr(gc, "freeze"):
+                # keep the collector from touching, and copying, the shared pages
+                gc.freeze()
         self.spawn_cluster()
         self.guard()
 
@@ -176,11 +206,15 @@ class Sentinel:
         if not self.start_event.is_set() and not self.stop_event.is_set():
             return Conf.STARTING
         elif self.start_event.is_set() and not self.stop_event.is_set():
-            if self.result_queue.empty() and self.task_queue.empty():
+            if all(q.empty() for q in self.result_queues) and self.task_queue.empty():
                 return Conf.IDLE
             return Conf.WORKING
         elif self.stop_event.is_set() and self.start_event.is_set():
-            if self.monitor.is_alive() or self.pusher.is_alive() or len(self.pool) > 0:
+            if (
+                any(m.is_alive() for m in self.monitors)
+                or self.pusher.is_alive()
+                or len(self.pool) > 0
+            ):
                 return Conf.STOPPING
             return Conf.STOPPED
 
@@ -190,7 +224,7 @@ class Sentinel:
         """
         p = Process(target=target, args=args)
         p.daemon = True
-        if target == worker:
+        if target in (worker, thread_worker, async_worker):
             p.daemon = Conf.DAEMONIZE_WORKERS
             p.timer = args[2]
             self.pool.append(p)
@@ -201,12 +235,32 @@ class Sentinel:
         return self.spawn_process(pusher, self.task_queue, self.event_out, self.broker)
 
     def spawn_worker(self):
+        if Conf.WORKER_COROUTINES:
+            # tasks time out on the event loop
+            self.spawn_process(
+                async_worker,
+                self.task_queue,
+                self.result_queues,
+                Value("f", -1),
+                self.timeout,
+            )
+            return
+        if Conf.WORKER_THREADS:
+            # a timer for each thread
+            self.spawn_process(
+                thread_worker,
+                self.task_queue,
+                self.result_queues,
+                Array("f", [-1] * Conf.WORKER_THREADS),
+                self.timeout,
+            )
+            return
         self.spawn_process(
-            worker, self.task_queue, self.result_queue, Value("f", -1), self.timeout
+            worker, self.task_queue, self.result_queues, Value("f", -1), self.timeout
         )
 
-    def spawn_monitor(self) -> Process:
-        return self.spawn_process(monitor, self.result_queue, self.broker)
+    def spawn_monitor(self, result_queue: Queue) -> Process:
+        return self.spawn_process(monitor, result_queue, self.broker)
 
     def reincarnate(self, process):
         """
@@ -215,8 +269,9 @@ class Sentinel:
         """
         if not Conf.SYNC:
             db.connections.close_all()  # Close any old connections
-        if process == self.monitor:
-            self.monitor = self.spawn_monitor()
+        if process in self.monitors:
+            i = self.monitors.index(process)
+            self.monitors[i] = self.spawn_monitor(self.result_queues[i])
             logger.error(_(f"reincarnated monitor {process.name} after sudden death"))
         elif process == self.pusher:
             self.pusher = self.spawn_pusher()
@@ -224,11 +279,12 @@ class Sentinel:
         else:
             self.pool.remove(process)
             self.spawn_worker()
-            if process.timer.value == 0:
+            values = timers(process.timer)
+            if 0 in values:
                 # only need to terminate on timeout, otherwise we risk destabilizing the queues
                 process.terminate()
                 logger.warning(_(f"reincarnated worker {process.name} after timeout"))
-            elif int(process.timer.value) == -2:
+            elif -2 in values:
                 logger.info(_(f"recycled worker {process.name}"))
             else:
                 logger.error(_(f"reincarnated worker {process.name} after death"))
@@ -244,7 +300,7 @@ class Sentinel:
         for __ in range(self.pool_size):
             self.spawn_worker()
         # spawn auxiliary
-        self.monitor = self.spawn_monitor()
+        self.monitors = [self.spawn_monitor(q) for q in self.result_queues]
         self.pusher = self.spawn_pusher()
         # set worker cpu affinity if needed
         if psutil and Conf.CPU_AFFINITY:
@@ -266,24 +322,34 @@ class Sentinel:
             # Check Workers
             for p in self.pool:
                 with p.timer.get_lock():
+                    values = timers(p.timer)
                     # Are you alive?
-                    if not p.is_alive() or p.timer.value == 0:
+                    if not p.is_alive() or 0 in values:
                         self.reincarnate(p)
                         continue
-                    # Decrement timer if work is being done
-                    if p.timer.value > 0:
-                        p.timer.value -= cycle
-            # Check Monitor
-            if not self.monitor.is_alive():
-                self.reincarnate(self.monitor)
+                    # Decrement timers if work is being done
+                    if len(values) == 1:
+                        if p.timer.value > 0:
+                            p.timer.value -= cycle
+                        continue
+                    for slot, value in enumerate(values):
+                        if value > 0:
+                            p.timer[slot] = value - cycle
+            # Check Monitors
+            for m in self.monitors:
+                if not m.is_alive():
+                    self.reincarnate(m)
             # Check Pusher
             if not self.pusher.is_alive():
                 self.reincarnate(self.pusher)
             # Call scheduler once a minute (or so)
             counter += cycle
-            if counter >= 30 and Conf.SCHEDULER:
+            if counter >= 30:
                 counter = 0
-                scheduler(broker=self.broker)
+                if Conf.SCHEDULER:
+                    scheduler(broker=self.broker)
+                requeue_expired(broker=self.broker)
+                prune()
             # Save current status
             Stat(self).save()
             sleep(cycle)
@@ -312,11 +378,13 @@ class Sentinel:
                     self.pool.remove(p)
             sleep(0.1)
             Stat(self).save()
-        # Finally stop the monitor
-        self.result_queue.put("STOP")
-        self.result_queue.close()
-        # Wait for the result queue to empty
-        self.result_queue.join_thread()
+        # Finally stop the monitors
+        for result_queue in self.result_queues:
+            result_queue.put("STOP")
+            result_queue.close()
+        # Wait for the result queues to empty
+        for result_queue in self.result_queues:
+            result_queue.join_thread()
         logger.info(_(f"{name} waiting for the monitor."))
         # Wait for everything to close or time out
         count = 0
@@ -340,30 +408,115 @@ def pusher(task_queue: Queue, event: Event, broker: Broker = None):
     if not broker:
         broker = get_broker()
     logger.info(_(f"{current_process().name} pushing tasks at {current_process().pid}"))
-    while True:
+    if Conf.PUSHER_THREADS:
+        prefetch(task_queue, event, broker)
+    else:
+        while True:
+            try:
+                task_set = broker.dequeue()
+            except Exception as e:
+                logger.error(e, traceback.format_exc())
+                # broker probably crashed. Let the sentinel handle it.
+                sleep(10)
+                break
+            if task_set:
+                push_tasks(task_set, task_queue, broker)
+            if event.is_set():
+                break
+    logger.info(_(f"{current_process().name} stopped pushing tasks"))
+
+
+def push_tasks(task_set: list, task_queue: Queue, broker: Broker):
+    """
+    Unpacks tasks fetched from the broker and puts them in the task queue
+    :type task_set: list
+    :type task_queue: multiprocessing.Queue
+    :type broker: brokers.Broker
+    """
+    for task in task_set:
+        ack_id = task[0]
+        # unpack the task
         try:
-            task_set = broker.dequeue()
-        except Exception as e:
+            if Conf.DEFER_UNPACK:
+                # the worker unpacks it
+                task = {"package": SignedPackage.verify(task[1])}
+            else:
+                task = SignedPackage.loads(task[1])
+        except (TypeError, BadSignature) as e:
             logger.error(e, traceback.format_exc())
-            # broker probably crashed. Let the sentinel handle it.
-            sleep(10)
-            break
-        if task_set:
-            for task in task_set:
-                ack_id = task[0]
-                # unpack the task
-                try:
-                    task = SignedPackage.loads(task[1])
-                except (TypeError, BadSignature) as e:
-                    logger.error(e, traceback.format_exc())
-                    broker.fail(ack_id)
-                    continue
-                task["ack_id"] = ack_id
-                task_queue.put(task)
-            logger.debug(_(f"queueing from {broker.list_key}"))
-        if event.is_set():
-            break
-    logger.info(_(f"{current_process().name} stopped pushing tasks"))
+            broker.fail(ack_id)
+            continue
+        task["ack_id"] = ack_id
+        task_queue.put(task)
+    logger.debug(_(f"queueing from {broker.list_key}"))
+
+
+def prefetch(task_queue: Queue, event: Event, broker: Broker):
+    """
+    Fetches tasks with Conf.PUSHER_THREADS threads into a buffer, while this thread unpacks them.
+    Fetching pauses while the buffer and the task queue hold Conf.QUEUE_LIMIT tasks.
+    :type task_queue: multiprocessing.Queue
+    :type event: multiprocessing.Event
+    :type broker: brokers.Broker
+    """
+    buffer = deque()
+    ready = threading.Condition()
+    stop = threading.Event()
+    crashed = threading.Event()
+    limit = Conf.QUEUE_LIMIT or Conf.PUSHER_THREADS * Conf.BULK
+
+    def backlog() -> int:
+        if Conf.QSIZE:
+            return len(buffer) + task_queue.qsize()
+        return len(buffer)
+
+    def fetch():
+        # broker connections aren't shared between threads
+        fetch_broker = pickle.loads(pickle.dumps(broker))
+        while not stop.is_set():
+            if backlog() >= limit:
+                # the workers have enough to do
+                stop.wait(0.01)
+                continue
+            try:
+                task_set = fetch_broker.dequeue()
+            except Exception as e:
+                logger.error(e, traceback.format_exc())
+                crashed.set()
+                break
+            if task_set:
+                with ready:
+                    buffer.extend(task_set)
+                    ready.notify()
+
+    fetchers = [
+        threading.Thread(target=fetch, name=f"{current_process().name}-fetcher-{i}")
+        for i in range(Conf.PUSHER_THREADS)
+    ]
+    for fetcher in fetchers:
+        fetcher.start()
+    try:
+        while not (event.is_set() or crashed.is_set()):
+            with ready:
+                if not buffer:
+                    ready.wait(0.1)
+                task_set = list(buffer)
+            if task_set:
+                push_tasks(task_set, task_queue, broker)
+                # keep the tasks in the backlog until they are in the task queue
+                with ready:
+                    for _ in task_set:
+                        buffer.popleft()
+    finally:
+        stop.set()
+        for fetcher in fetchers:
+            fetcher.join()
+    # queue what was fetched while stopping
+    if buffer:
+        push_tasks(list(buffer), task_queue, broker)
+    if crashed.is_set():
+        # broker probably crashed. Let the sentinel handle it.
+        sleep(10)
 
 
 def monitor(result_queue: Queue, broker: Broker = None):
@@ -376,12 +529,74 @@ def monitor(result_queue: Queue, broker: Broker = None):
         broker = get_broker()
     name = current_process().name
     logger.info(_(f"{name} monitoring at {current_process().pid}"))
-    for task in iter(result_queue.get, "STOP"):
-        # save the result
-        if task.get("cached", False):
+    stopping = False
+    while not stopping:
+        try:
+            # a floor, so an idle monitor with a flush_interval of 0 doesn't spin
+            task = result_queue.get(timeout=max(Conf.FLUSH_INTERVAL, 0.1))
+        except queue.Empty:
+            # idle, send any buffered acknowledgements
+            broker.flush()
+            continue
+        if task == "STOP":
+            break
+        # collect a batch of results
+        batch = [task]
+        deadline = time() + Conf.MONITOR_WINDOW
+        while len(batch) < Conf.MONITOR_BATCH:
+            try:
+                task = result_queue.get(timeout=max(deadline - time(), 0))
+            except queue.Empty:
+                break
+            if task == "STOP":
+                stopping = True
+                break
+            if task.get("id") and task["id"] in (t.get("id") for t in batch):
+                # a retry of a task in this batch, it needs the saved result
+                save_results(batch, broker)
+                batch = []
+            batch.append(task)
+        save_results(batch, broker)
+    broker.flush()
+    logger.info(_(f"{name} stopped monitoring results"))
+
+
+def save_results(tasks: list, broker: Broker):
+    """
+    Saves a batch of finished tasks, acknowledges them and signals their execution
+    :param tasks: the task packages
+    :type broker: brokers.Broker
+    """
+    saved = []
+    for task in tasks:
+        # the worker couldn't unpack the task
+        if task.get("discard", False):
+            broker.fail(task["ack_id"])
+        elif task.get("cached", False):
             save_cached(task, broker)
+            saved.append(task)
         else:
-            save_task(task, broker)
+            saved.append(task)
+    # save the results
+    if Conf.MONITOR_BATCH > 1:
+        save_tasks([t for t in saved if not t.get("cached", False)], broker)
+    else:
+        for task in saved:
+            if not task.get("cached", False):
+                save_task(task, broker)
+    # wake up callers waiting for these results
+    keys = {
+        key
+        for task in saved
+        for key in (task["id"], task["name"], task.get("group"))
+        if key
+    }
+    if keys:
+        try:
+            broker.notify(list(keys))
+        except Exception as e:
+            logger.error(_(f"Could not notify result waiters: {e}"))
+    for task in saved:
         # acknowledge result
         ack_id = task.pop("ack_id", False)
         if ack_id and (task["success"] or task.get("ack_failure", False)):
@@ -395,7 +610,6 @@ def monitor(result_queue: Queue, broker: Broker = None):
         else:
             # log failure
             logger.error(_(f"Failed [{task['name']}] - {task['result']}"))
-    logger.info(_(f"{name} stopped monitoring results"))
 
 
 def worker(
@@ -405,52 +619,447 @@ def worker(
     Takes a task from the task queue, tries to execute it and puts the result back in the result queue
     :param timeout: number of seconds wait for a worker to finish.
     :type task_queue: multiprocessing.Queue
-    :type result_queue: multiprocessing.Queue
+    :type result_queue: multiprocessing.Queue or a list of them, one for each monitor
     :type timer: multiprocessing.Value
     """
     name = current_process().name
     logger.info(_(f"{name} ready for work at {current_process().pid}"))
+    preload()
     task_count = 0
     if timeout is None:
         timeout = -1
     # Start reading the task queue
     for task in iter(task_queue.get, "STOP"):
-        result = None
-        timer.value = -1  # Idle
+        if not execute(task, result_queue, timer, timeout):
+            continue
         task_count += 1
-        # Get the function from the task
-        logger.info(_(f'{name} processing [{task["name"]}]'))
-        f = task["func"]
-        # if it's not an instance try to get it from the string
-        if not callable(task["func"]):
-            f = pydoc.locate(f)
-        close_old_django_connections()
-        timer_value = task.pop("timeout", timeout)
-        # signal execution
-        pre_execute.send(sender="django_q", func=f, task=task)
-        # execute the payload
-        timer.value = timer_value  # Busy
-        try:
-            res = f(*task["args"], **task["kwargs"])
-            result = (res, True)
-        except Exception as e:
-            result = (f"{e} : {traceback.format_exc()}", False)
-            if error_reporter:
-                error_reporter.report()
-            if task.get("sync", False):
-                raise
         with timer.get_lock():
-            # Process result
-            task["result"] = result[0]
-            task["success"] = result[1]
-            task["stopped"] = timezone.now()
-            result_queue.put(task)
-            timer.value = -1  # Idle
             # Recycle
             if task_count == Conf.RECYCLE or rss_check():
                 timer.value = -2  # Recycled
                 break
     logger.info(_(f"{name} stopped doing work"))
+    logger.debug(_(f"{name} function cache {locate.cache_info()}"))
+
+
+def thread_worker(
+    task_queue: Queue, result_queue: Queue, timer: Array, timeout: int = Conf.TIMEOUT
+):
+    """
+    Takes tasks from the task queue and executes them with a pool of Conf.WORKER_THREADS threads
+    :param timeout: number of seconds wait for a task to finish.
+    :type task_queue: multiprocessing.Queue
+    :type result_queue: multiprocessing.Queue or a list of them, one for each monitor
+    :type timer: multiprocessing.Array with a timer for each thread
+    """
+    name = current_process().name
+    logger.info(
+        _(f"{name} ready for work with {len(timer)} threads at {current_process().pid}")
+    )
+    preload()
+    task_count = 0
+    if timeout is None:
+        timeout = -1
+    # free thread slots, so we only take tasks we can start right away
+    slots = queue.Queue()
+    for slot in range(len(timer)):
+        slots.put(slot)
+
+    def run(task, slot):
+        try:
+            execute(task, result_queue, TimerSlot(timer, slot), timeout)
+        except Exception as e:
+            logger.error(_(f"{name} failed to execute a task: {e}"))
+        finally:
+            slots.put(slot)
+
+    recycle = False
+    with ThreadPoolExecutor(len(timer), thread_name_prefix=name) as executor:
+        # Start reading the task queue
+        while True:
+            # wait for a free thread first, so other workers can take the task
+            slot = slots.get()
+            task = task_queue.get()
+            if task == "STOP":
+                break
+            executor.submit(run, task, slot)
+            task_count += 1
+            # Recycle
+            if task_count == Conf.RECYCLE or rss_check():
+                recycle = True
+                break
+    # the executor waits for the running tasks
+    if recycle:
+        with timer.get_lock():
+            timer[:] = [-2] * len(timer)  # Recycled
+    logger.info(_(f"{name} stopped doing work"))
+    logger.debug(_(f"{name} function cache {locate.cache_info()}"))
+
+
+def async_worker(
+    task_queue: Queue, result_queue: Queue, timer: Value, timeout: int = Conf.TIMEOUT
+):
+    """
+    Takes tasks from the task queue and runs up to Conf.WORKER_COROUTINES of them at once on an event loop
+    :param timeout: number of seconds wait for a task to finish.
+    :type task_queue: multiprocessing.Queue
+    :type result_queue: multiprocessing.Queue or a list of them, one for each monitor
+    :type timer: multiprocessing.Value
+    """
+    name = current_process().name
+    logger.info(
+        _(
+            f"{name} ready for work with {Conf.WORKER_COROUTINES} coroutines at {current_process().pid}"
+        )
+    )
+    preload()
+    if timeout is None:
+        timeout = -1
+    asyncio.run(run_async(task_queue, result_queue, timer, timeout))
+    logger.info(_(f"{name} stopped doing work"))
+    logger.debug(_(f"{name} function cache {locate.cache_info()}"))
+
+
+async def run_async(task_queue: Queue, result_queue: Queue, timer: Value, timeout: int):
+    """
+    The event loop of the async worker
+    """
+    loop = asyncio.get_event_loop()
+    slots = asyncio.Semaphore(Conf.WORKER_COROUTINES)
+    deadlines = TimerDeadlines(timer)
+    running = set()
+    task_count = 0
+    recycle = False
+    name = current_process().name
+    # regular functions get a thread for each coroutine, reading the queue gets its own
+    executor = ThreadPoolExecutor(Conf.WORKER_COROUTINES, thread_name_prefix=name)
+    reader = ThreadPoolExecutor(1, thread_name_prefix=f"{name}-reader")
+    try:
+        while True:
+            # only take tasks we can start right away
+            await slots.acquire()
+            task = await loop.run_in_executor(reader, task_queue.get)
+            if task == "STOP":
+                break
+            job = asyncio.ensure_future(
+                execute_async(task, result_queue, deadlines, timeout, executor)
+            )
+            running.add(job)
+            job.add_done_callback(running.discard)
+            job.add_done_callback(lambda _: slots.release())
+            task_count += 1
+            # Recycle
+            if task_count == Conf.RECYCLE or rss_check():
+                recycle = True
+                break
+        if running:
+            await asyncio.wait(running)
+    finally:
+        reader.shutdown(wait=False)
+        executor.shutdown(wait=False)
+    if recycle:
+        timer.value = -2  # Recycled
+
+
+class TimerDeadlines:
+    """
+    Keeps the timer of an async worker at the earliest deadline of its running tasks,
+    so the sentinel kills the worker when a task can't be stopped in time
+    """
+
+    def __init__(self, timer: Value):
+        self.timer = timer
+        self.deadlines = {}
+
+    def start(self, key, timeout: Optional[float]):
+        self.deadlines[key] = time() + timeout if timeout else None
+        self.update()
+
+    def finish(self, key):
+        self.deadlines.pop(key, None)
+        self.update()
+
+    def update(self):
+        # tasks without a timeout can't be timed out by the sentinel
+        deadlines = [d for d in self.deadlines.values() if d is not None]
+        with self.timer.get_lock():
+            if not deadlines:
+                self.timer.value = -1  # Idle
+                return
+            # a stuck task keeps counting down, whatever starts after it
+            # whole seconds, so the sentinel counts down to 0
+            remaining = math.ceil(min(deadlines) + TIMEOUT_GRACE - time())
+            self.timer.value = max(remaining, 0)  # Busy
+
+
+class TimerSlot:
+    """
+    One slot of a thread worker timer, used like the timer of a process worker
+    """
+
+    def __init__(self, timer: Array, slot: int):
+        self.timer = timer
+        self.slot = slot
+
+    @property
+    def value(self) -> float:
+        return self.timer[self.slot]
+
+    @value.setter
+    def value(self, value: float):
+        self.timer[self.slot] = value
+
+    def get_lock(self):
+        return self.timer.get_lock()
+
+
+def timers(timer) -> list:
+    """
+    :param timer: the timer of a worker process
+    :return: the timer values of each task the worker runs at the same time
+    """
+    return list(timer[:]) if hasattr(timer, "__len__") else [timer.value]
+
+
+def execute(task: dict, result_queue: Queue, timer, timeout: int) -> bool:
+    """
+    Executes a task and puts the result in the result queue
+    :param task: the task package from the task queue
+    :type result_queue: multiprocessing.Queue or a list of them, one for each monitor
+    :type timer: multiprocessing.Value or TimerSlot
+    :param timeout: the default timeout for the task
+    :return: False if the task could not be unpacked
+    """
+    task = unpack(task, result_queue)
+    if task is None:
+        return False
+    result = None
+    timer.value = -1  # Idle
+    # Get the function from the task
+    logger.info(_(f'{current_process().name} processing [{task["name"]}]'))
+    f = task["func"]
+    # if it's not an instance try to get it from the string
+    if not callable(task["func"]):
+        f = locate(f)
+    close_old_django_connections()
+    timer_value = task.pop("timeout", timeout)
+    # signal execution
+    pre_execute.send(sender="django_q", func=f, task=task)
+    # execute the payload
+    alarm = use_alarm(timer_value, task)
+    if alarm:
+        # the alarm stops the task, the sentinel only kills the worker if that fails
+        timer.value = timer_value + TIMEOUT_GRACE  # Busy
+    else:
+        timer.value = timer_value  # Busy
+    try:
+        try:
+            if alarm:
+                set_alarm(timer_value)
+            res = f(*task["args"], **task["kwargs"])
+            # await coroutine functions on a loop of their own
+            if inspect.iscoroutine(res):
+                res = asyncio.run(res)
+        finally:
+            # before anything is recorded, so a late alarm can't interrupt it
+            if alarm:
+                set_alarm(0)
+        result = (res, True)
+    except TimeoutException as e:
+        result = (f"{e} : {traceback.format_exc()}", False)
+    except Exception as e:
+        result = (f"{e} : {traceback.format_exc()}", False)
+        if error_reporter:
+            error_reporter.report()
+        if task.get("sync", False):
+            raise
+    with timer.get_lock():
+        report(task, result, result_queue)
+        timer.value = -1  # Idle
+    return True
+
+
+class TimeoutException(BaseException):
+    """
+    Raised inside a task that runs longer than its timeout, when Conf.WORKER_TIMEOUT is set
+    Not an Exception, so tasks that catch all exceptions still stop
+    """
+
+    pass
+
+
+def use_alarm(timeout, task: dict) -> bool:
+    """
+    Whether the worker can stop this task with an alarm signal
+    Signals are only delivered to the main thread and not available on Windows.
+    """
+    return bool(
+        Conf.WORKER_TIMEOUT
+        and timeout
+        and timeout > 0
+        and not task.get("sync", False)
+        and hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+    )
+
+
+def set_alarm(timeout: float):
+    """
+    Raises a TimeoutException in the current task after timeout seconds. 0 cancels the alarm
+    """
+
+    def alarm(signum, frame):
+        raise TimeoutException(_(f"Task exceeded timeout of {timeout} seconds"))
+
+    if timeout:
+        signal.signal(signal.SIGALRM, alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+
+
+async def execute_async(
+    task: dict,
+    result_queue: Queue,
+    timer: TimerDeadlines,
+    timeout: int,
+    executor: ThreadPoolExecutor,
+):
+    """
+    Awaits a task on the running event loop and puts the result in the result queue
+    Functions that are not coroutine functions run in the executor
+    :param task: the task package from the task queue
+    :type result_queue: multiprocessing.Queue or a list of them, one for each monitor
+    :param timer: the deadlines of the running tasks
+    :param timeout: the default timeout for the task
+    :param executor: the threads that run regular functions
+    """
+    task = unpack(task, result_queue)
+    if task is None:
+        return
+    logger.info(_(f'{current_process().name} processing [{task["name"]}]'))
+    f = task["func"]
+    # if it's not an instance try to get it from the string
+    if not callable(task["func"]):
+        f = locate(f)
+    timer_value = task.pop("timeout", timeout)
+    if timer_value is None or timer_value < 0:
+        timer_value = None
+    key = object()
+    timer.start(key, timer_value)
+    # signal execution
+    pre_execute.send(sender="django_q", func=f, task=task)
+    # execute the payload
+    try:
+        if inspect.iscoroutinefunction(f):
+            aw = f(*task["args"], **task["kwargs"])
+        else:
+            future = executor.submit(call, f, task["args"], task["kwargs"])
+            # a thread can't be stopped, so its deadline counts until it returns
+            loop = asyncio.get_event_loop()
+            future.add_done_callback(
+                lambda _: loop.call_soon_threadsafe(timer.finish, key)
+            )
+            aw = asyncio.wrap_future(future)
+        res = await asyncio.wait_for(aw, timer_value)
+        if inspect.iscoroutine(res):
+            res = await asyncio.wait_for(res, timer_value)
+        result = (res, True)
+    except asyncio.TimeoutError:
+        result = (_(f"Task exceeded timeout of {timer_value} seconds"), False)
+    except Exception as e:
+        result = (f"{e} : {traceback.format_exc()}", False)
+        if error_reporter:
+            error_reporter.report()
+    if inspect.iscoroutinefunction(f):
+        timer.finish(key)
+    report(task, result, result_queue)
+
+
+def call(f, args: tuple, kwargs: dict):
+    """
+    Calls a regular function from the async worker in an executor thread
+    """
+    close_old_django_connections()
+    return f(*args, **kwargs)
+
+
+def unpack(task: dict, result_queue: Queue) -> Optional[dict]:
+    """
+    Unpacks a task the pusher left packed, see push_tasks
+    :return: the task or None if it could not be unpacked
+    """
+    if "package" not in task:
+        return task
+    ack_id = task["ack_id"]
+    try:
+        task = SignedPackage.unpack(task["package"])
+    except Exception as e:
+        logger.error(_(f"{current_process().name} could not unpack a task: {e}"))
+        shard(result_queue, ack_id).put({"ack_id": ack_id, "discard": True})
+        return None
+    task["ack_id"] = ack_id
+    return task
+
+
+def report(task: dict, result: tuple, result_queue: Queue):
+    """
+    Puts the result of a task in the result queue
+    :param result: the result and whether the task succeeded
+    """
+    task["result"] = result[0]
+    task["success"] = result[1]
+    task["stopped"] = timezone.now()
+    shard(result_queue, task["id"]).put(task)
+
+
+def locate(path: str):
+    """
+    Resolves a dotted path to an object, once for each process
+    Paths that don't resolve aren't cached, so they are tried again for the next task.
+    :param path: dotted path of a function or module
+    :return: the object or None
+    """
+    try:
+        return _locate(path)
+    except LookupError:
+        return None
+
+
+@lru_cache(maxsize=1024)
+def _locate(path: str):
+    f = pydoc.locate(path)
+    if f is None:
+        # lru_cache doesn't store exceptions
+        raise LookupError(path)
+    return f
+
+
+locate.cache_info = _locate.cache_info
+locate.cache_clear = _locate.cache_clear
+
+
+def preload():
+    """
+    Resolves the functions and modules in Conf.PRELOAD, so they are imported before the first task
+    """
+    for path in Conf.PRELOAD:
+        try:
+            if locate(path) is None:
+                logger.warning(_(f"Could not preload {path}"))
+        except Exception as e:
+            logger.error(_(f"Failed to preload {path}: {e}"))
+
+
+def shard(result_queues, key) -> Queue:
+    """
+    Picks the result queue for a task, so all results of a task go to the same monitor
+    :param result_queues: a result queue or a list of them
+    :param key: the task id
+    """
+    if not isinstance(result_queues, (list, tuple)):
+        return result_queues
+    if len(result_queues) == 1:
+        return result_queues[0]
+    return result_queues[zlib.crc32(str(key).encode()) % len(result_queues)]
 
 
 def save_task(task, broker: Broker):
@@ -471,56 +1080,134 @@ def save_task(task, broker: Broker):
             sync=task["sync"],
             broker=broker,
         )
-    # SAVE LIMIT > 0: Prune database, SAVE_LIMIT 0: No pruning
     close_old_django_connections()
     try:
-        with db.transaction.atomic():
-            last = Success.objects.select_for_update().last()
-            if task["success"] and 0 < Conf.SAVE_LIMIT <= Success.objects.count():
-                last.delete()
-        # check if this task has previous results
-        if Task.objects.filter(id=task["id"], name=task["name"]).exists():
+        try:
+            # most tasks are saved on their first attempt
+            with db.transaction.atomic():
+                new_task(task).save(force_insert=True)
+            return
+        except db.IntegrityError:
+            # this task has previous results
             existing_task = Task.objects.get(id=task["id"], name=task["name"])
-            # only update the result if it hasn't succeeded yet
-            if not existing_task.success:
-                existing_task.stopped = task["stopped"]
-                existing_task.result = task["result"]
-                existing_task.success = task["success"]
-                existing_task.attempt_count = existing_task.attempt_count + 1
-                existing_task.save()
+        # only update the result if it hasn't succeeded yet
+        if not existing_task.success:
+            existing_task.stopped = task["stopped"]
+            existing_task.result = task["result"]
+            existing_task.success = task["success"]
+            existing_task.attempt_count = existing_task.attempt_count + 1
+            existing_task.save()
 
-            if (
-                Conf.MAX_ATTEMPTS > 0
-                and existing_task.attempt_count >= Conf.MAX_ATTEMPTS
-            ):
-                broker.acknowledge(task["ack_id"])
+        if Conf.MAX_ATTEMPTS > 0 and existing_task.attempt_count >= Conf.MAX_ATTEMPTS:
+            broker.acknowledge(task["ack_id"])
+    except Exception as e:
+        logger.error(e)
 
-        else:
-            func = task["func"]
-            # convert func to string
-            if inspect.isfunction(func):
-                func = f"{func.__module__}.{func.__name__}"
-            elif inspect.ismethod(func):
-                func = (
-                    f"{func.__self__.__module__}."
-                    f"{func.__self__.__name__}.{func.__name__}"
+
+def new_task(task) -> Task:
+    """
+    Builds the Task model for a task package
+    :param task: the task package
+    """
+    func = task["func"]
+    # convert func to string
+    if inspect.isfunction(func):
+        func = f"{func.__module__}.{func.__name__}"
+    elif inspect.ismethod(func):
+        func = f"{func.__self__.__module__}.{func.__self__.__name__}.{func.__name__}"
+    return Task(
+        id=task["id"],
+        name=task["name"],
+        func=func,
+        hook=task.get("hook"),
+        args=task["args"],
+        kwargs=task["kwargs"],
+        started=task["started"],
+        stopped=task["stopped"],
+        result=task["result"],
+        group=task.get("group"),
+        success=task["success"],
+        attempt_count=1,
+    )
+
+
+def save_tasks(tasks: list, broker: Broker):
+    """
+    Saves a batch of task packages to Django with bulk queries
+    Falls back to save_task for each task if the batch fails.
+    :param tasks: the task packages
+    :type broker: brokers.Broker
+    """
+    # SAVE LIMIT < 0 : Don't save success
+    tasks = [
+        t for t in tasks if t.get("save", Conf.SAVE_LIMIT >= 0) or not t["success"]
+    ]
+    if not tasks:
+        return
+    # enqueues next in a chain
+    for task in tasks:
+        if task.get("chain", None):
+            django_q.tasks.async_chain(
+                task["chain"],
+                group=task["group"],
+                cached=task["cached"],
+                sync=task["sync"],
+                broker=broker,
+            )
+    close_old_django_connections()
+    try:
+        with db.transaction.atomic():
+            # check which tasks have previous results
+            existing = {
+                (t.id, t.name): t
+                for t in Task.objects.select_for_update().filter(
+                    id__in=[task["id"] for task in tasks]
                 )
-            Task.objects.create(
-                id=task["id"],
-                name=task["name"],
-                func=func,
-                hook=task.get("hook"),
-                args=task["args"],
-                kwargs=task["kwargs"],
-                started=task["started"],
-                stopped=task["stopped"],
-                result=task["result"],
-                group=task.get("group"),
-                success=task["success"],
-                attempt_count=1,
+            }
+            created, updated = [], []
+            for task in tasks:
+                existing_task = existing.get((task["id"], task["name"]))
+                if existing_task is None:
+                    created.append(new_task(task))
+                    continue
+                # only update the result if it hasn't succeeded yet
+                if not existing_task.success:
+                    existing_task.stopped = task["stopped"]
+                    existing_task.result = task["result"]
+                    existing_task.success = task["success"]
+                    existing_task.attempt_count = existing_task.attempt_count + 1
+                    updated.append(existing_task)
+                if (
+                    Conf.MAX_ATTEMPTS > 0
+                    and existing_task.attempt_count >= Conf.MAX_ATTEMPTS
+                ):
+                    broker.acknowledge(task["ack_id"])
+            Task.objects.bulk_create(created)
+            Task.objects.bulk_update(
+                updated, ["stopped", "result", "success", "attempt_count"]
             )
     except Exception as e:
         logger.error(e)
+        # save what we can
+        for task in tasks:
+            save_task(dict(task, chain=None), broker)
+        return
+    # bulk queries skip the signals, so the hooks wouldn't run
+    using = db.router.db_for_write(Task)
+    for instances, is_created in ((created, True), (updated, False)):
+        for instance in instances:
+            try:
+                post_save.send(
+                    sender=Task,
+                    instance=instance,
+                    created=is_created,
+                    update_fields=None,
+                    raw=False,
+                    using=using,
+                )
+            except Exception as e:
+                # the results are saved, so carry on and acknowledge them
+                logger.error(e)
 
 
 def save_cached(task, broker: Broker):
@@ -651,7 +1338,7 @@ def scheduler(broker: Broker = None):
                 # send it to the cluster
                 scheduled_broker = broker
                 try:
-                    scheduled_broker = get_broker(q_options["broker_name"])
+                    scheduled_broker = get_shared_broker(q_options["broker_name"])
                 except:  # invalid broker_name or non existing broker with broker_name
                     pass
                 q_options["broker"] = scheduled_broker
@@ -684,6 +1371,38 @@ def scheduler(broker: Broker = None):
         logger.error(e)
 
 
+def requeue_expired(broker: Broker):
+    """
+    Returns expired unacknowledged tasks to the queue on brokers that need it
+    """
+    try:
+        broker.requeue_expired()
+    except Exception as e:
+        logger.error(e)
+
+
+def prune():
+    """
+    Deletes the successful tasks beyond the save limit or older than the save limit age
+    """
+    close_old_django_connections()
+    try:
+        # SAVE LIMIT > 0: Prune database, SAVE_LIMIT 0: No pruning
+        if Conf.SAVE_LIMIT > 0:
+            # the oldest success we keep
+            cutoff = Success.objects.values_list("stopped", flat=True)[
+                Conf.SAVE_LIMIT - 1 : Conf.SAVE_LIMIT
+            ]
+            if cutoff:
+                Success.objects.filter(stopped__lt=cutoff[0]).delete()
+        if Conf.SAVE_LIMIT_AGE:
+            Success.objects.filter(
+                stopped__lt=timezone.now() - timedelta(seconds=Conf.SAVE_LIMIT_AGE)
+            ).delete()
+    except Exception as e:
+        logger.error(e)
+
+
 def close_old_django_connections():
     """
     Close django connections unless running with sync=True.
@@ -41,6 +41,12 @@ class Conf:
     # Redis server configuration . Follows standard redis keywords
     REDIS = conf.get("redis", {})
 
+    # Keep Redis tasks in a processing list until they are acknowledged
+    REDIS_RELIABLE = conf.get("redis_reliable", False)
+
+    # Use the Redis streams broker
+    REDIS_STREAMS = conf.get("redis_streams", False)
+
     # Support for Django-Redis connections
 
     DJANGO_REDIS = conf.get("django_redis", None)
@@ -72,6 +78,15 @@ class Conf:
     # Database Poll
     POLL = conf.get("poll", 0.2)
 
+    # Use LISTEN/NOTIFY instead of polling with the ORM broker on PostgreSQL
+    ORM_NOTIFY = conf.get("orm_notify", False)
+
+    # SQLite broker database file
+    SQLITE = conf.get("sqlite", None)
+
+    # Milliseconds the SQLite broker waits for a locked database
+    SQLITE_BUSY_TIMEOUT = conf.get("sqlite_busy_timeout", 5000)
+
     # MongoDB broker
     MONGO = conf.get("mongo", None)
     MONGO_DB = conf.get("mongo_db", None)
@@ -86,6 +101,9 @@ class Conf:
     # Failures are always saved
     SAVE_LIMIT = conf.get("save_limit", 250)
 
+    # Number of seconds successful tasks are kept in the database. 0 keeps them regardless of age
+    SAVE_LIMIT_AGE = conf.get("save_limit_age", 0)
+
     # Guard loop sleep in seconds. Should be between 0 and 60 seconds.
     GUARD_CYCLE = conf.get("guard_cycle", 0.5)
 
@@ -109,8 +127,26 @@ class Conf:
     # Option to undaemonize the workers and allow them to spawn child processes
     DAEMONIZE_WORKERS = conf.get("daemonize_workers", True)
 
+    # Number of threads each worker runs tasks in. 0 runs one task at a time in the worker process
+    WORKER_THREADS = conf.get("worker_threads", 0)
+
+    # Number of coroutine tasks each worker runs at once on an event loop. 0 disables the async worker
+    WORKER_COROUTINES = conf.get("worker_coroutines", 0)
+
     # Maximum number of tasks that each cluster can work on
-    QUEUE_LIMIT = conf.get("queue_limit", int(WORKERS) ** 2)
+    QUEUE_LIMIT = conf.get(
+        "queue_limit",
+        int(WORKERS) * max(int(WORKERS), int(WORKER_THREADS), int(WORKER_COROUTINES)),
+    )
+
+    # Number of threads the pusher uses to fetch tasks from the broker. 0 fetches in the pusher itself
+    PUSHER_THREADS = conf.get("pusher_threads", 0)
+
+    # Let the workers unpack tasks instead of the pusher. The pusher only checks the signature
+    DEFER_UNPACK = conf.get("defer_unpack", False)
+
+    # Functions or modules the workers import when they start
+    PRELOAD = conf.get("preload", [])
 
     # Sets compression of redis packages
     COMPRESSED = conf.get("compress", False)
@@ -125,6 +161,9 @@ class Conf:
     # Number of seconds to wait for a worker to finish.
     TIMEOUT = conf.get("timeout", None)
 
+    # Let the worker stop tasks that exceed the timeout with a signal, instead of the sentinel restarting it
+    WORKER_TIMEOUT = conf.get("worker_timeout", False)
+
     # Whether to acknowledge unsuccessful tasks.
     # This causes failed tasks to be considered delivered, thereby removing them from
     # the task queue. Defaults to False.
@@ -142,6 +181,19 @@ class Conf:
         See https://django-q.readthedocs.io/en/latest/configure.html#retry for details."""
         )
 
+    # Number of seconds a broker can buffer acknowledgements before sending them.
+    # Only works with brokers that batch acknowledgements. Defaults to 1 second.
+    FLUSH_INTERVAL = conf.get("flush_interval", 1)
+
+    # Number of monitor processes saving results. Results are divided by task id
+    MONITORS = conf.get("monitors", 1)
+
+    # Number of results the monitor saves at once. 1 saves each result as it arrives
+    MONITOR_BATCH = conf.get("monitor_batch", 1)
+
+    # Number of seconds the monitor waits for a batch of results to fill up
+    MONITOR_WINDOW = conf.get("monitor_window", 0.1)
+
     # Sets the amount of tasks the cluster will try to pop off the broker.
     # If it supports bulk gets.
     BULK = conf.get("bulk", 1)
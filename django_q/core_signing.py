@@ -30,9 +30,23 @@ def loads(
 
     The serializer is expected to accept a bytestring.
     """
+    return decode(unsign(s, key=key, salt=salt, max_age=max_age), serializer)
+
+
+def unsign(s, key=None, salt: str = "django.core.signing", max_age=None) -> bytes:
+    """
+    Checks the signature of dumps() output, raise BadSignature if signature fails.
+    Returns the encoded value for decode().
+    """
     # TimestampSigner.unsign() returns str but base64 and zlib compression
     # operate on bytes.
-    base64d = force_bytes(TimestampSigner(key, salt=salt).unsign(s, max_age=max_age))
+    return force_bytes(TimestampSigner(key, salt=salt).unsign(s, max_age=max_age))
+
+
+def decode(base64d: bytes, serializer=JSONSerializer):
+    """
+    Decodes a value returned by unsign().
+    """
     decompress = False
     if base64d[:1] == b".":
         # It's compressed; uncompress it first
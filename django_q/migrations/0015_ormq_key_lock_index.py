@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_q', '0014_schedule_cluster'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ormq',
+            index=models.Index(fields=['key', 'lock', 'id'], name='django_q_or_key_ecb876_idx'),
+        ),
+    ]
@@ -250,6 +250,7 @@ class OrmQ(models.Model):
         app_label = "django_q"
         verbose_name = _("Queued task")
         verbose_name_plural = _("Queued tasks")
+        indexes = [models.Index(fields=["key", "lock", "id"])]
 
 
 # Backwards compatibility for Django 1.7
@@ -404,12 +404,16 @@ def memory(run_once=False, workers=False, broker=None):
                     term.move(row, 5 * col_width)
                     + term.center(get_process_mb(stat.sentinel), width=col_width - 1)
                 )
+                monitors = getattr(stat, "monitors", None) or [
+                    getattr(stat, "monitor", None)
+                ]
+                results = [get_process_mb(monitor_pid) for monitor_pid in monitors]
+                found = [mb for mb in results if not isinstance(mb, str)]
+                # keep the error when none of the monitors could be found
+                monitors_mb = round(sum(found), 2) if found else results[-1]
                 print(
                     term.move(row, 6 * col_width)
-                    + term.center(
-                        get_process_mb(getattr(stat, "monitor", None)),
-                        width=col_width - 1,
-                    )
+                    + term.center(monitors_mb, width=col_width - 1)
                 )
                 workers_mb = 0
                 for worker_pid in stat.workers:
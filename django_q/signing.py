@@ -1,4 +1,5 @@
 """Package signing."""
+
 import pickle
 
 from django_q import core_signing as signing
@@ -26,6 +27,16 @@ class SignedPackage:
             obj, key=Conf.SECRET_KEY, salt=Conf.PREFIX, serializer=PickleSerializer
         )
 
+    @staticmethod
+    def verify(obj) -> bytes:
+        """Checks the signature and returns the package for unpack."""
+        return signing.unsign(obj, key=Conf.SECRET_KEY, salt=Conf.PREFIX)
+
+    @staticmethod
+    def unpack(data: bytes) -> any:
+        """Decodes a package returned by verify."""
+        return signing.decode(data, serializer=PickleSerializer)
+
 
 class PickleSerializer:
     """Simple wrapper around Pickle for signing.dumps and signing.loads."""
@@ -22,6 +22,7 @@ class Status:
         self.done_q_size = 0
         self.host = socket.gethostname()
         self.monitor = 0
+        self.monitors = []
         self.task_q_size = 0
         self.pusher = 0
         self.timestamp = timezone.now()
@@ -42,10 +43,11 @@ class Stat(Status):
         self.done_q_size = 0
         self.task_q_size = 0
         if Conf.QSIZE:
-            self.done_q_size = sentinel.result_queue.qsize()
+            self.done_q_size = sum(q.qsize() for q in sentinel.result_queues)
             self.task_q_size = sentinel.task_queue.qsize()
         if sentinel.monitor:
             self.monitor = sentinel.monitor.pid
+        self.monitors = [m.pid for m in sentinel.monitors]
         if sentinel.pusher:
             self.pusher = sentinel.pusher.pid
         self.workers = [w.pid for w in sentinel.pool]
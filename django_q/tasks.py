@@ -1,5 +1,9 @@
 """Provides task functionality."""
+
 # Standard
+import asyncio
+from contextlib import ExitStack, contextmanager
+from functools import partial
 from multiprocessing import Value
 from time import sleep, time
 
@@ -8,7 +12,7 @@ from django.db import IntegrityError
 from django.utils import timezone
 
 # local
-from django_q.brokers import get_broker
+from django_q.brokers import get_shared_broker
 from django_q.conf import Conf, logger
 from django_q.humanhash import uuid
 from django_q.models import Schedule, Task
@@ -19,6 +23,72 @@ from django_q.signing import SignedPackage
 
 def async_task(func, *args, **kwargs):
     """Queue a task for the cluster."""
+    task, broker, pack = _prepare(func, args, kwargs)
+    if task.get("sync", False):
+        return _sync(pack)
+    # push it
+    enqueue_id = broker.enqueue(pack)
+    logger.info(f"Enqueued {enqueue_id}")
+    logger.debug(f"Pushed {task['id']}")
+    return task["id"]
+
+
+def async_many(func, args_iter, **kwargs):
+    """
+    Queue a task for every set of arguments with a single broker batch.
+    Accepts the same options as async_task and returns the list of task ids.
+    """
+    kwargs = kwargs.copy()
+    if "q_options" in kwargs:
+        options = kwargs["q_options"] = kwargs["q_options"].copy()
+    else:
+        options = kwargs
+    # make sure all tasks share one broker
+    options["broker"] = options.get("broker") or get_shared_broker()
+    tasks = []
+    packs = []
+    for args in args_iter:
+        if not isinstance(args, tuple):
+            args = (args,)
+        task, broker, pack = _prepare(func, args, kwargs)
+        tasks.append(task)
+        packs.append(pack)
+    if not tasks:
+        return []
+    if tasks[0].get("sync", False):
+        return [_sync(pack) for pack in packs]
+    # push them
+    enqueue_ids = broker.enqueue_many(packs)
+    # brokers raise when they can't queue a task, so this is a broken broker
+    if len(enqueue_ids) != len(packs):
+        raise RuntimeError(
+            f"{broker.info()} queued {len(enqueue_ids)} of {len(packs)} tasks"
+        )
+    logger.info(f"Enqueued {len(packs)} tasks")
+    return [task["id"] for task in tasks]
+
+
+async def async_task_async(func, *args, **kwargs):
+    """
+    Queue a task for the cluster from async code.
+    Accepts the same options as async_task.
+    The package is built on the event loop, only the broker call runs in a thread.
+    """
+    # asgiref comes with Django 3.0 and later
+    from asgiref.sync import sync_to_async
+
+    task, broker, pack = _prepare(func, args, kwargs)
+    if task.get("sync", False):
+        return await sync_to_async(_sync)(pack)
+    # push it
+    enqueue_id = await sync_to_async(broker.enqueue)(pack)
+    logger.info(f"Enqueued {enqueue_id}")
+    logger.debug(f"Pushed {task['id']}")
+    return task["id"]
+
+
+def _prepare(func, args, kwargs):
+    """Build and sign a task package. Returns the task, its broker and the package."""
     keywords = kwargs.copy()
     opt_keys = (
         "hook",
@@ -40,7 +110,7 @@ def async_task(func, *args, **kwargs):
     task = {
         "id": tag[1],
         "name": keywords.pop("task_name", None)
-        or q_options.pop("task_name", None)
+        or q_options.get("task_name", None)
         or tag[0],
         "func": func,
         "args": args,
@@ -52,7 +122,7 @@ def async_task(func, *args, **kwargs):
         elif key in keywords:
             task[key] = keywords.pop(key)
     # don't serialize the broker
-    broker = task.pop("broker", get_broker())
+    broker = task.pop("broker", None) or get_shared_broker()
     # overrides
     if "cached" not in task and Conf.CACHED:
         task["cached"] = Conf.CACHED
@@ -66,14 +136,7 @@ def async_task(func, *args, **kwargs):
     # signal it
     pre_enqueue.send(sender="django_q", task=task)
     # sign it
-    pack = SignedPackage.dumps(task)
-    if task.get("sync", False):
-        return _sync(pack)
-    # push it
-    enqueue_id = broker.enqueue(pack)
-    logger.info(f"Enqueued {enqueue_id}")
-    logger.debug(f"Pushed {tag}")
-    return task["id"]
+    return task, broker, SignedPackage.dumps(task)
 
 
 def schedule(func, *args, **kwargs):
@@ -127,7 +190,7 @@ def schedule(func, *args, **kwargs):
     return s
 
 
-def result(task_id, wait=0, cached=Conf.CACHED):
+def result(task_id, wait=0, cached=Conf.CACHED, broker=None):
     """
     Return the result of the named task.
 
@@ -136,19 +199,31 @@ def result(task_id, wait=0, cached=Conf.CACHED):
     :type wait: int
     :param wait: number of milliseconds to wait for a result
     :param bool cached: run this against the cache backend
+    :param broker: the broker that is notified of the result
     :return: the result object of this task
     :rtype: object
     """
     if cached:
-        return result_cached(task_id, wait)
+        return result_cached(task_id, wait, broker)
     start = time()
-    while True:
-        r = Task.get_result(task_id)
-        if r:
-            return r
-        if (time() - start) * 1000 >= wait >= 0:
-            break
-        sleep(0.01)
+    with _listen(task_id, wait, broker) as pause:
+        while True:
+            r = Task.get_result(task_id)
+            if r:
+                return r
+            if (time() - start) * 1000 >= wait >= 0:
+                break
+            pause()
+
+
+async def result_async(task_id, wait=0, cached=Conf.CACHED, broker=None):
+    """
+    Return the result of the named task from async code.
+    Takes the same arguments as result.
+    """
+    return await _wait_async(
+        partial(result, task_id, cached=cached, broker=broker), task_id, wait, broker
+    )
 
 
 def result_cached(task_id, wait=0, broker=None):
@@ -156,18 +231,21 @@ def result_cached(task_id, wait=0, broker=None):
     Return the result from the cache backend
     """
     if not broker:
-        broker = get_broker()
+        broker = get_shared_broker()
     start = time()
-    while True:
-        r = broker.cache.get(f"{broker.list_key}:{task_id}")
-        if r:
-            return SignedPackage.loads(r)["result"]
-        if (time() - start) * 1000 >= wait >= 0:
-            break
-        sleep(0.01)
+    with _listen(task_id, wait, broker) as pause:
+        while True:
+            r = broker.cache.get(f"{broker.list_key}:{task_id}")
+            if r:
+                return SignedPackage.loads(r)["result"]
+            if (time() - start) * 1000 >= wait >= 0:
+                break
+            pause()
 
 
-def result_group(group_id, failures=False, wait=0, count=None, cached=Conf.CACHED):
+def result_group(
+    group_id, failures=False, wait=0, count=None, cached=Conf.CACHED, broker=None
+):
     """
     Return a list of results for a task group.
 
@@ -175,27 +253,29 @@ def result_group(group_id, failures=False, wait=0, count=None, cached=Conf.CACHE
     :param bool failures: set to True to include failures
     :param int count: Block until there are this many results in the group
     :param bool cached: run this against the cache backend
+    :param broker: the broker that is notified of the results
     :return: list or results
     """
     if cached:
-        return result_group_cached(group_id, failures, wait, count)
+        return result_group_cached(group_id, failures, wait, count, broker)
     start = time()
-    if count:
+    with _listen(group_id, wait, broker) as pause:
+        if count:
+            while True:
+                if (
+                    count_group(group_id) == count
+                    or wait
+                    and (time() - start) * 1000 >= wait >= 0
+                ):
+                    break
+                pause()
         while True:
-            if (
-                count_group(group_id) == count
-                or wait
-                and (time() - start) * 1000 >= wait >= 0
-            ):
+            r = Task.get_result_group(group_id, failures)
+            if r:
+                return r
+            if (time() - start) * 1000 >= wait >= 0:
                 break
-            sleep(0.01)
-    while True:
-        r = Task.get_result_group(group_id, failures)
-        if r:
-            return r
-        if (time() - start) * 1000 >= wait >= 0:
-            break
-        sleep(0.01)
+            pause()
 
 
 def result_group_cached(group_id, failures=False, wait=0, count=None, broker=None):
@@ -203,32 +283,33 @@ def result_group_cached(group_id, failures=False, wait=0, count=None, broker=Non
     Return a list of results for a task group from the cache backend
     """
     if not broker:
-        broker = get_broker()
+        broker = get_shared_broker()
     start = time()
-    if count:
+    with _listen(group_id, wait, broker) as pause:
+        if count:
+            while True:
+                if (
+                    count_group_cached(group_id, broker=broker) == count
+                    or wait
+                    and (time() - start) * 1000 >= wait > 0
+                ):
+                    break
+                pause()
         while True:
-            if (
-                count_group_cached(group_id) == count
-                or wait
-                and (time() - start) * 1000 >= wait > 0
-            ):
+            group_list = broker.cache.get(f"{broker.list_key}:{group_id}:keys")
+            if group_list:
+                result_list = []
+                for task_key in group_list:
+                    task = SignedPackage.loads(broker.cache.get(task_key))
+                    if task["success"] or failures:
+                        result_list.append(task["result"])
+                return result_list
+            if (time() - start) * 1000 >= wait >= 0:
                 break
-            sleep(0.01)
-    while True:
-        group_list = broker.cache.get(f"{broker.list_key}:{group_id}:keys")
-        if group_list:
-            result_list = []
-            for task_key in group_list:
-                task = SignedPackage.loads(broker.cache.get(task_key))
-                if task["success"] or failures:
-                    result_list.append(task["result"])
-            return result_list
-        if (time() - start) * 1000 >= wait >= 0:
-            break
-        sleep(0.01)
-
-
-def fetch(task_id, wait=0, cached=Conf.CACHED):
+            pause()
+
+
+def fetch(task_id, wait=0, cached=Conf.CACHED, broker=None):
     """
     Return the processed task.
 
@@ -237,19 +318,94 @@ def fetch(task_id, wait=0, cached=Conf.CACHED):
     :param wait: the number of milliseconds to wait for a result
     :type wait: int
     :param bool cached: run this against the cache backend
+    :param broker: the broker that is notified of the result
     :return: the full task object
     :rtype: Task
     """
     if cached:
-        return fetch_cached(task_id, wait)
+        return fetch_cached(task_id, wait, broker)
+    start = time()
+    with _listen(task_id, wait, broker) as pause:
+        while True:
+            t = Task.get_task(task_id)
+            if t:
+                return t
+            if (time() - start) * 1000 >= wait >= 0:
+                break
+            pause()
+
+
+async def fetch_async(task_id, wait=0, cached=Conf.CACHED, broker=None):
+    """
+    Return the processed task from async code.
+    Takes the same arguments as fetch.
+    """
+    return await _wait_async(
+        partial(fetch, task_id, cached=cached, broker=broker), task_id, wait, broker
+    )
+
+
+@contextmanager
+def _listen(key, wait, broker=None):
+    """
+    Listens for results of a task or group while waiting for them.
+    Yields a function that blocks until a result is saved or the wait is over.
+    """
+    start = time()
+    if not wait:
+        # only group counts wait without a wait time
+        yield lambda: sleep(0.01)
+        return
+    if not broker:
+        broker = get_shared_broker()
+    with broker.listen(key) as listener:
+
+        def pause():
+            if wait < 0:
+                listener(1)
+            else:
+                # check again at least every second, in case we missed a notification
+                listener(max(0, min(1, wait / 1000 - (time() - start))))
+
+        yield pause
+
+
+async def _wait_async(get, key, wait, broker=None):
+    """
+    Await get until it returns something or wait milliseconds have passed.
+    Waits for the broker to notify key in between, like _listen.
+    The lookups and the waits run in threads, the event loop is never blocked.
+    """
+    from asgiref.sync import sync_to_async
+
+    # lookups don't need the thread of the request, so they don't queue up behind it
+    get = sync_to_async(get, thread_sensitive=False)
+    if not wait:
+        return await get()
     start = time()
-    while True:
-        t = Task.get_task(task_id)
-        if t:
-            return t
-        if (time() - start) * 1000 >= wait >= 0:
-            break
-        sleep(0.01)
+    listening = ExitStack()
+
+    def subscribe():
+        return listening.enter_context((broker or get_shared_broker()).listen(key))
+
+    # the same thread subscribes and unsubscribes, the ORM broker listens on its connection
+    listener = await sync_to_async(subscribe, thread_sensitive=True)()
+    pause = sync_to_async(listener, thread_sensitive=False)
+    try:
+        while True:
+            r = await get()
+            if r:
+                return r
+            elapsed = (time() - start) * 1000
+            if elapsed >= wait >= 0:
+                return None
+            if wait < 0:
+                await pause(1)
+            else:
+                # check again at least every second, in case we missed a notification
+                await pause(max(0, min(1, (wait - elapsed) / 1000)))
+    finally:
+        await sync_to_async(listening.close, thread_sensitive=True)()
 
 
 def fetch_cached(task_id, wait=0, broker=None):
@@ -257,57 +413,62 @@ def fetch_cached(task_id, wait=0, broker=None):
     Return the processed task from the cache backend
     """
     if not broker:
-        broker = get_broker()
+        broker = get_shared_broker()
     start = time()
-    while True:
-        r = broker.cache.get(f"{broker.list_key}:{task_id}")
-        if r:
-            task = SignedPackage.loads(r)
-            return Task(
-                id=task["id"],
-                name=task["name"],
-                func=task["func"],
-                hook=task.get("hook"),
-                args=task["args"],
-                kwargs=task["kwargs"],
-                started=task["started"],
-                stopped=task["stopped"],
-                result=task["result"],
-                success=task["success"],
-            )
-        if (time() - start) * 1000 >= wait >= 0:
-            break
-        sleep(0.01)
+    with _listen(task_id, wait, broker) as pause:
+        while True:
+            r = broker.cache.get(f"{broker.list_key}:{task_id}")
+            if r:
+                task = SignedPackage.loads(r)
+                return Task(
+                    id=task["id"],
+                    name=task["name"],
+                    func=task["func"],
+                    hook=task.get("hook"),
+                    args=task["args"],
+                    kwargs=task["kwargs"],
+                    started=task["started"],
+                    stopped=task["stopped"],
+                    result=task["result"],
+                    success=task["success"],
+                )
+            if (time() - start) * 1000 >= wait >= 0:
+                break
+            pause()
 
 
-def fetch_group(group_id, failures=True, wait=0, count=None, cached=Conf.CACHED):
+def fetch_group(
+    group_id, failures=True, wait=0, count=None, cached=Conf.CACHED, broker=None
+):
     """
     Return a list of Tasks for a task group.
 
     :param str group_id: the group id
     :param bool failures: set to False to exclude failures
     :param bool cached: run this against the cache backend
+    :param broker: the broker that is notified of the results
     :return: list of Tasks
     """
     if cached:
-        return fetch_group_cached(group_id, failures, wait, count)
+        return fetch_group_cached(group_id, failures, wait, count, broker)
     start = time()
-    if count:
+    with _listen(group_id, wait, broker) as pause:
+        if count:
+            while True:
+                if (
+                    count_group(group_id) == count
+                    or wait
+                    and (time() - start) * 1000 >= wait >= 0
+                ):
+                    break
+                pause()
         while True:
-            if (
-                count_group(group_id) == count
-                or wait
-                and (time() - start) * 1000 >= wait >= 0
-            ):
+            r = Task.get_task_group(group_id, failures)
+            if r:
+                return r
+            if (time() - start) * 1000 >= wait >= 0:
                 break
-            sleep(0.01)
-    while True:
-        r = Task.get_task_group(group_id, failures)
-        if r:
-            return r
-        if (time() - start) * 1000 >= wait >= 0:
-            break
-        sleep(0.01)
+            pause()
 
 
 def fetch_group_cached(group_id, failures=True, wait=0, count=None, broker=None):
@@ -315,42 +476,43 @@ def fetch_group_cached(group_id, failures=True, wait=0, count=None, broker=None)
     Return a list of Tasks for a task group in the cache backend
     """
     if not broker:
-        broker = get_broker()
+        broker = get_shared_broker()
     start = time()
-    if count:
+    with _listen(group_id, wait, broker) as pause:
+        if count:
+            while True:
+                if (
+                    count_group_cached(group_id, broker=broker) == count
+                    or wait
+                    and (time() - start) * 1000 >= wait >= 0
+                ):
+                    break
+                pause()
         while True:
-            if (
-                count_group_cached(group_id) == count
-                or wait
-                and (time() - start) * 1000 >= wait >= 0
-            ):
+            group_list = broker.cache.get(f"{broker.list_key}:{group_id}:keys")
+            if group_list:
+                task_list = []
+                for task_key in group_list:
+                    task = SignedPackage.loads(broker.cache.get(task_key))
+                    if task["success"] or failures:
+                        t = Task(
+                            id=task["id"],
+                            name=task["name"],
+                            func=task["func"],
+                            hook=task.get("hook"),
+                            args=task["args"],
+                            kwargs=task["kwargs"],
+                            started=task["started"],
+                            stopped=task["stopped"],
+                            result=task["result"],
+                            group=task.get("group"),
+                            success=task["success"],
+                        )
+                        task_list.append(t)
+                return task_list
+            if (time() - start) * 1000 >= wait >= 0:
                 break
-            sleep(0.01)
-    while True:
-        group_list = broker.cache.get(f"{broker.list_key}:{group_id}:keys")
-        if group_list:
-            task_list = []
-            for task_key in group_list:
-                task = SignedPackage.loads(broker.cache.get(task_key))
-                if task["success"] or failures:
-                    t = Task(
-                        id=task["id"],
-                        name=task["name"],
-                        func=task["func"],
-                        hook=task.get("hook"),
-                        args=task["args"],
-                        kwargs=task["kwargs"],
-                        started=task["started"],
-                        stopped=task["stopped"],
-                        result=task["result"],
-                        group=task.get("group"),
-                        success=task["success"],
-                    )
-                    task_list.append(t)
-            return task_list
-        if (time() - start) * 1000 >= wait >= 0:
-            break
-        sleep(0.01)
+            pause()
 
 
 def count_group(group_id, failures=False, cached=Conf.CACHED):
@@ -373,7 +535,7 @@ def count_group_cached(group_id, failures=False, broker=None):
     Count the results in a group in the cache backend
     """
     if not broker:
-        broker = get_broker()
+        broker = get_shared_broker()
     group_list = broker.cache.get(f"{broker.list_key}:{group_id}:keys")
     if group_list:
         if not failures:
@@ -406,7 +568,7 @@ def delete_group_cached(group_id, broker=None):
     Delete a group from the cache backend
     """
     if not broker:
-        broker = get_broker()
+        broker = get_shared_broker()
     group_key = f"{broker.list_key}:{group_id}:keys"
     group_list = broker.cache.get(group_key)
     broker.cache.delete_many(group_list)
@@ -418,7 +580,7 @@ def delete_cached(task_id, broker=None):
     Delete a task from the cache backend
     """
     if not broker:
-        broker = get_broker()
+        broker = get_shared_broker()
     return broker.cache.delete(f"{broker.list_key}:{task_id}")
 
 
@@ -432,7 +594,7 @@ def queue_size(broker=None):
     :rtype: int
     """
     if not broker:
-        broker = get_broker()
+        broker = get_shared_broker()
     return broker.queue_size()
 
 
@@ -445,7 +607,7 @@ def async_iter(func, args_iter, **kwargs):
     # clean up the kwargs
     options = kwargs.get("q_options", kwargs)
     options.pop("hook", None)
-    options["broker"] = options.get("broker", get_broker())
+    options["broker"] = options.get("broker") or get_shared_broker()
     options["group"] = iter_group
     options["iter_count"] = iter_count
     if options.get("cached", None):
@@ -456,10 +618,7 @@ def async_iter(func, args_iter, **kwargs):
     broker.cache.set(
         f"{broker.list_key}:{iter_group}:args", SignedPackage.dumps(args_iter)
     )
-    for args in args_iter:
-        if not isinstance(args, tuple):
-            args = (args,)
-        async_task(func, *args, **options)
+    async_many(func, args_iter, **options)
     return iter_group
 
 
@@ -483,7 +642,7 @@ def async_chain(chain, group=None, cached=Conf.CACHED, sync=Conf.SYNC, broker=No
     kwargs["group"] = group
     kwargs["cached"] = cached
     kwargs["sync"] = sync
-    kwargs["broker"] = broker or get_broker()
+    kwargs["broker"] = broker or get_shared_broker()
     async_task(task[0], *args, **kwargs)
     return group
 
@@ -506,7 +665,7 @@ class Iter:
         self.args = args or []
         self.kwargs = kwargs or {}
         self.id = ""
-        self.broker = broker or get_broker()
+        self.broker = broker or get_shared_broker()
         self.cached = cached
         self.sync = sync
         self.started = False
@@ -539,7 +698,7 @@ class Iter:
         :return: an unsorted list of results
         """
         if self.started:
-            return result(self.id, wait=wait, cached=self.cached)
+            return result(self.id, wait=wait, cached=self.cached, broker=self.broker)
 
     def fetch(self, wait=0):
         """
@@ -548,7 +707,7 @@ class Iter:
         :return: an unsorted list of task objects
         """
         if self.started:
-            return fetch(self.id, wait=wait, cached=self.cached)
+            return fetch(self.id, wait=wait, cached=self.cached, broker=self.broker)
 
     def length(self):
         """
@@ -566,7 +725,7 @@ class Chain:
     def __init__(self, chain=None, group=None, cached=Conf.CACHED, sync=Conf.SYNC):
         self.chain = chain or []
         self.group = group or ""
-        self.broker = get_broker()
+        self.broker = get_shared_broker()
         self.cached = cached
         self.sync = sync
         self.started = False
@@ -606,7 +765,11 @@ class Chain:
         """
         if self.started:
             return result_group(
-                self.group, wait=wait, count=self.length(), cached=self.cached
+                self.group,
+                wait=wait,
+                count=self.length(),
+                cached=self.cached,
+                broker=self.broker,
             )
 
     def fetch(self, failures=True, wait=0):
@@ -623,6 +786,7 @@ class Chain:
                 wait=wait,
                 count=self.length(),
                 cached=self.cached,
+                broker=self.broker,
             )
 
     def current(self):
@@ -723,12 +887,12 @@ class AsyncTask:
     def result(self, wait=0):
 
         if self.started:
-            return result(self.id, wait=wait, cached=self.cached)
+            return result(self.id, wait=wait, cached=self.cached, broker=self.broker)
 
     def fetch(self, wait=0):
 
         if self.started:
-            return fetch(self.id, wait=wait, cached=self.cached)
+            return fetch(self.id, wait=wait, cached=self.cached, broker=self.broker)
 
     def result_group(self, failures=False, wait=0, count=None):
 
@@ -739,6 +903,7 @@ class AsyncTask:
                 wait=wait,
                 count=count,
                 cached=self.cached,
+                broker=self.broker,
             )
 
     def fetch_group(self, failures=True, wait=0, count=None):
@@ -750,6 +915,7 @@ class AsyncTask:
                 wait=wait,
                 count=count,
                 cached=self.cached,
+                broker=self.broker,
             )
 
 
@@ -764,7 +930,7 @@ def _sync(pack):
     task_queue.put("STOP")
     worker(task_queue, result_queue, Value("f", -1))
     result_queue.put("STOP")
-    monitor(result_queue)
+    monitor(result_queue, broker=get_shared_broker())
     task_queue.close()
     task_queue.join_thread()
     result_queue.close()
@@ -1,3 +1,4 @@
+import asyncio
 from time import sleep
 
 
@@ -14,6 +15,11 @@ def multiply(x, y):
     return x * y
 
 
+async def async_multiply(x, y, delay=0):
+    await asyncio.sleep(delay)
+    return x * y
+
+
 def count_letters(tup):
     total = 0
     for word in tup:
@@ -34,6 +40,13 @@ def count_forever():
         sleep(0.5)
 
 
+def sleep_catch_all(seconds):
+    try:
+        sleep(seconds)
+    except Exception:
+        return "caught"
+
+
 def get_task_name(task):
     return task.name
 
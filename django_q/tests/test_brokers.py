@@ -1,12 +1,21 @@
 import os
-from time import sleep
+import pickle
+from datetime import timedelta
+from functools import partial
+from threading import Thread, Timer
+from time import sleep, time
 
 import pytest
 import redis
+from django.db import connections
+from django.utils import timezone
 
-from django_q.brokers import Broker, get_broker
+from django_q import brokers
+from django_q.brokers import Broker, get_broker, get_shared_broker
 from django_q.conf import Conf
 from django_q.humanhash import uuid
+from django_q.models import OrmQ
+from django_q.tasks import async_many
 
 
 def test_broker(monkeypatch):
@@ -50,6 +59,182 @@ def test_redis(monkeypatch):
         broker.ping()
 
 
+def test_redis_reliable(monkeypatch):
+    monkeypatch.setattr(Conf, "REDIS_RELIABLE", True)
+    broker = get_broker(list_key="reliable_test")
+    broker.delete_queue()
+    # async_task
+    task_id = broker.enqueue("test")
+    assert broker.queue_size() == 1
+    # dequeue moves the message id to the processing list
+    task = broker.dequeue()[0]
+    assert task == (task_id, b"test")
+    assert broker.queue_size() == 0
+    assert broker.lock_size() == 1
+    broker.acknowledge(task[0])
+    assert broker.lock_size() == 0
+    # the payload is removed with the acknowledgement
+    assert broker.connection.hlen(broker.payload_key) == 0
+    # tasks queued without reliable mode are their own id
+    broker.connection.rpush(broker.list_key, "old")
+    task = broker.dequeue()[0]
+    assert task == (b"old", b"old")
+    broker.acknowledge(task[0])
+    assert broker.lock_size() == 0
+    # blocking dequeue
+    assert broker.dequeue() is None
+    # Retry test
+    monkeypatch.setattr(Conf, "RETRY", 1)
+    broker.enqueue("test")
+    broker.dequeue()
+    assert broker.requeue_expired() == 0
+    assert broker.lock_size() == 1
+    sleep(1.5)
+    assert broker.requeue_expired() == 1
+    assert broker.queue_size() == 1
+    assert broker.lock_size() == 0
+    task = broker.dequeue()[0]
+    broker.acknowledge(task[0])
+    sleep(1.5)
+    assert broker.requeue_expired() == 0
+    assert broker.queue_size() == 0
+    # fail
+    broker.enqueue("test")
+    task = broker.dequeue()[0]
+    broker.fail(task[0])
+    assert broker.lock_size() == 0
+    # test duplicate acknowledge
+    broker.acknowledge(task[0])
+    # delete queue
+    broker.enqueue("test")
+    broker.dequeue()
+    broker.enqueue("test")
+    broker.delete_queue()
+    assert broker.queue_size() == 0
+    assert broker.lock_size() == 0
+
+
+def test_redis_bulk(monkeypatch):
+    broker = get_broker(list_key="bulk_test")
+    broker.delete_queue()
+    assert broker.enqueue_many([]) == []
+    # one id for every task, like enqueue
+    assert broker.enqueue_many([f"test{i}" for i in range(7)]) == list(range(1, 8))
+    monkeypatch.setattr(Conf, "BULK", 5)
+    tasks = broker.dequeue()
+    assert [task[1] for task in tasks] == [f"test{i}".encode() for i in range(5)]
+    assert broker.queue_size() == 2
+    tasks = broker.dequeue()
+    assert len(tasks) == 2
+    assert broker.dequeue() is None
+    # reliable
+    monkeypatch.setattr(Conf, "REDIS_RELIABLE", True)
+    broker.enqueue_many([f"test{i}" for i in range(7)])
+    tasks = broker.dequeue()
+    assert len(tasks) == 5
+    assert broker.lock_size() == 5
+    for task in tasks:
+        broker.acknowledge(task[0])
+    assert broker.lock_size() == 0
+    assert len(broker.dequeue()) == 2
+    broker.delete_queue()
+
+
+@pytest.mark.skipif(
+    not os.getenv("DJANGO_Q_BENCHMARK"), reason="set DJANGO_Q_BENCHMARK to run"
+)
+def test_redis_reliable_benchmark(monkeypatch):
+    broker = get_broker(list_key="reliable_benchmark")
+    count = 10000
+
+    def run(reliable: bool) -> float:
+        monkeypatch.setattr(Conf, "REDIS_RELIABLE", reliable)
+        broker.delete_queue()
+        broker.enqueue_many(["x" * 1000] * count)
+        start = time()
+        done = 0
+        while done < count:
+            for task_id, _ in broker.dequeue():
+                broker.acknowledge(task_id)
+                done += 1
+        broker.flush()
+        assert broker.lock_size() == 0
+        return time() - start
+
+    # one task at a time, plain BLPOP against claim and acknowledge
+    plain = run(False)
+    reliable = run(True)
+    broker.delete_queue()
+    assert reliable < plain * 1.2
+
+
+def test_redis_notify():
+    broker = get_broker(list_key="notify_test")
+    with broker.listen("task") as wait:
+        # nothing published
+        start = time()
+        wait(0.2)
+        assert time() - start >= 0.2
+        Timer(0.1, broker.notify, args=[["task"]]).start()
+        start = time()
+        wait(5)
+        assert time() - start < 1
+
+
+def test_redis_streams(monkeypatch):
+    monkeypatch.setattr(Conf, "REDIS_STREAMS", True)
+    # check broker
+    broker = get_broker(list_key="streams_test")
+    assert broker.__class__.__name__ == "RedisStreams"
+    assert broker.ping() is True
+    assert broker.info() is not None
+    # clear before we start
+    broker.purge_queue()
+    # async_task
+    broker.enqueue("test")
+    assert broker.queue_size() == 1
+    # dequeue
+    task = broker.dequeue()[0]
+    assert task[1] == b"test"
+    assert broker.queue_size() == 0
+    assert broker.lock_size() == 1
+    broker.acknowledge(task[0])
+    assert broker.lock_size() == 0
+    assert broker.dequeue() is None
+    # Retry test
+    monkeypatch.setattr(Conf, "RETRY", 1)
+    broker.enqueue("test")
+    task = broker.dequeue()[0]
+    assert broker.lock_size() == 1
+    sleep(1.5)
+    retried = broker.dequeue()[0]
+    assert retried[0] == task[0]
+    broker.acknowledge(retried[0])
+    assert broker.lock_size() == 0
+    # fail
+    broker.enqueue("test")
+    task = broker.dequeue()[0]
+    broker.fail(task[0])
+    # test duplicate acknowledge
+    broker.acknowledge(task[0])
+    # bulk test
+    monkeypatch.setattr(Conf, "RETRY", 60)
+    broker.enqueue_many(["test"] * 5)
+    monkeypatch.setattr(Conf, "BULK", 5)
+    tasks = broker.dequeue()
+    assert len(tasks) == 5
+    assert broker.lock_size() == 5
+    for task in tasks:
+        broker.acknowledge(task[0])
+    assert broker.lock_size() == 0
+    # delete queue
+    broker.enqueue("test")
+    broker.enqueue("test")
+    broker.purge_queue()
+    assert broker.queue_size() == 0
+    broker.delete_queue()
+
+
 def test_custom(monkeypatch):
     monkeypatch.setattr(Conf, "BROKER_CLASS", "brokers.redis_broker.Redis")
     broker = get_broker()
@@ -246,6 +431,7 @@ def canceled_sqs(monkeypatch):
         broker.acknowledge(task[0])
     # duplicate acknowledge
     broker.acknowledge(task[0])
+    broker.flush()
     assert broker.lock_size() == 0
     # delete queue
     broker.enqueue("test")
@@ -359,9 +545,471 @@ def test_mongo(monkeypatch):
     assert broker.lock_size() == 0
     # test duplicate acknowledge
     broker.acknowledge(task[0])
+    # batched claim
+    assert broker.enqueue_many([]) == []
+    task_ids = broker.enqueue_many([f"test{i}" for i in range(7)])
+    monkeypatch.setattr(Conf, "BULK", 5)
+    tasks = broker.dequeue()
+    assert [task[0] for task in tasks] == task_ids[:5]
+    assert broker.lock_size() == 5
+    assert broker.queue_size() == 2
+    tasks += broker.dequeue()
+    assert len(tasks) == 7
+    for task in tasks:
+        broker.acknowledge(task[0])
+    assert broker.lock_size() == 0
+    # the lock is indexed
+    assert "lock_1" in broker.collection.index_information()
     # delete queue
     broker.enqueue("test")
     broker.enqueue("test")
     broker.purge_queue()
     broker.delete_queue()
     assert broker.queue_size() == 0
+
+
+def test_mongo_watch(monkeypatch):
+    monkeypatch.setattr(Conf, "MONGO", {"host": "127.0.0.1", "port": 27017})
+    broker = get_broker(list_key="mongo_watch_test")
+    broker.delete_queue()
+    # open the change stream on an empty queue
+    assert broker.dequeue() is None
+    if not broker._watch:
+        pytest.skip("MongoDB change streams need a replica set")
+    # an insert wakes up the waiting broker
+    Timer(0.1, broker.enqueue, args=["test"]).start()
+    start = time()
+    assert broker.dequeue() is None
+    assert time() - start < 0.9
+    task = broker.dequeue()[0]
+    assert task[1] == "test"
+    broker.acknowledge(task[0])
+    broker.delete_queue()
+
+
+@pytest.mark.django_db
+def test_orm_skip_locked(monkeypatch):
+    monkeypatch.setattr(Conf, "ORM", "default")
+    # force the single statement claim, sqlite ignores the row locks
+    monkeypatch.setattr(
+        connections["default"].features, "has_select_for_update_skip_locked", True
+    )
+    broker = get_broker(list_key="orm_skip_locked_test")
+    broker.delete_queue()
+    for _ in range(5):
+        broker.enqueue("test")
+    monkeypatch.setattr(Conf, "BULK", 3)
+    tasks = broker.dequeue()
+    assert len(tasks) == 3
+    assert broker.lock_size() == 3
+    assert broker.queue_size() == 2
+    tasks += broker.dequeue()
+    assert len(tasks) == 5
+    assert len({task[0] for task in tasks}) == 5
+    assert broker.dequeue() is None
+    for task in tasks:
+        assert task[1] == "test"
+        broker.acknowledge(task[0])
+    assert broker.lock_size() == 0
+    broker.delete_queue()
+
+
+@pytest.mark.django_db
+def test_orm_notify(monkeypatch):
+    monkeypatch.setattr(Conf, "ORM", "default")
+    monkeypatch.setattr(Conf, "ORM_NOTIFY", True)
+    broker = get_broker(list_key="orm_notify_test")
+    assert broker.channel == "django_q:orm_notify_test"
+    broker.delete_queue()
+    broker.enqueue("test")
+    task = broker.dequeue()[0]
+    assert task[1] == "test"
+    broker.acknowledge(task[0])
+    # not on postgres, so this falls back to polling
+    assert broker.dequeue() is None
+    assert broker._listener is None
+    broker.delete_queue()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(
+    connections["default"].vendor != "postgresql", reason="needs PostgreSQL"
+)
+def test_orm_notify_postgres(monkeypatch):
+    monkeypatch.setattr(Conf, "ORM", "default")
+    monkeypatch.setattr(Conf, "ORM_NOTIFY", True)
+    broker = get_broker(list_key="orm_notify_postgres_test")
+    broker.delete_queue()
+    # start listening on an empty queue
+    assert broker.dequeue() is None
+    assert broker._listener is not None
+    # a notification read by another query on the connection
+    Thread(target=broker.enqueue, args=["first"]).start()
+    sleep(0.2)
+    assert broker.queue_size() == 1
+    start = time()
+    broker._wait(timeout=5)
+    assert time() - start < 1
+    task = broker.dequeue()[0]
+    assert task[1] == "first"
+    broker.acknowledge(task[0])
+    # an enqueue from another connection wakes the waiting broker
+    Timer(0.1, broker.enqueue, args=["third"]).start()
+    start = time()
+    assert broker.dequeue() is None
+    assert time() - start < 0.9
+    task = broker.dequeue()[0]
+    assert task[1] == "third"
+    broker.acknowledge(task[0])
+    # a task queued before a new connection listens, like after close_old_connections
+    lock = timezone.now() - timedelta(seconds=Conf.RETRY + 1)
+    OrmQ.objects.create(key=broker.list_key, payload="fourth", lock=lock)
+    broker._listener = None
+    start = time()
+    broker._wait(timeout=5)
+    assert time() - start < 1
+    task = broker.dequeue()[0]
+    assert task[1] == "fourth"
+    broker.acknowledge(task[0])
+    broker.delete_queue()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(
+    connections["default"].vendor != "postgresql", reason="needs PostgreSQL"
+)
+def test_orm_result_notify_postgres(monkeypatch):
+    monkeypatch.setattr(Conf, "ORM", "default")
+    monkeypatch.setattr(Conf, "ORM_NOTIFY", True)
+    broker = get_broker(list_key="orm_result_notify_test")
+    with broker.listen("first") as first, broker.listen("second") as second:
+        # a single statement notifies both channels
+        Timer(0.1, broker.notify, args=[["first", "second"]]).start()
+        start = time()
+        first(5)
+        second(5)
+        assert time() - start < 1
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(
+    not os.getenv("DJANGO_Q_BENCHMARK"), reason="set DJANGO_Q_BENCHMARK to run"
+)
+def test_orm_poll_benchmark(monkeypatch):
+    monkeypatch.setattr(Conf, "ORM", "default")
+    monkeypatch.setattr(Conf, "BULK", 10)
+    broker = get_broker(list_key="orm_benchmark_test")
+    broker.delete_queue()
+    # fill the table with a large backlog on another queue and a smaller one on ours
+    lock = timezone.now() - timedelta(seconds=Conf.RETRY + 1)
+    OrmQ.objects.bulk_create(
+        OrmQ(key="orm_benchmark_other", payload="test", lock=lock) for _ in range(20000)
+    )
+    OrmQ.objects.bulk_create(
+        OrmQ(key=broker.list_key, payload="test", lock=lock) for _ in range(1000)
+    )
+    # the claim query should be served by the (key, lock, id) index
+    if connections["default"].vendor == "sqlite":
+        plan = (
+            broker.get_connection()
+            .filter(key=broker.list_key, lock__lt=timezone.now())
+            .order_by("lock", "id")
+            .explain()
+        )
+        assert "django_q_or_key_ecb876_idx" in plan
+    # measure the poll latency
+    polls = 50
+    start = time()
+    for _ in range(polls):
+        tasks = broker.dequeue()
+        assert len(tasks) == Conf.BULK
+    latency = (time() - start) / polls
+    assert latency < 0.1
+    assert broker.lock_size() == polls * Conf.BULK
+    OrmQ.objects.filter(key="orm_benchmark_other").delete()
+    broker.delete_queue()
+
+
+@pytest.mark.django_db
+def test_orm_enqueue_many(monkeypatch):
+    monkeypatch.setattr(Conf, "ORM", "default")
+    broker = get_broker(list_key="orm_enqueue_many_test")
+    broker.delete_queue()
+    assert broker.enqueue_many([]) == []
+    ids = broker.enqueue_many([f"test{i}" for i in range(25)])
+    assert len(ids) == 25
+    assert broker.queue_size() == 25
+    monkeypatch.setattr(Conf, "BULK", 25)
+    tasks = broker.dequeue()
+    assert [task[1] for task in tasks] == [f"test{i}" for i in range(25)]
+    for task in tasks:
+        broker.acknowledge(task[0])
+    assert broker.queue_size() == 0
+    broker.delete_queue()
+
+
+@pytest.mark.django_db
+def test_shared_broker(monkeypatch):
+    monkeypatch.setattr(Conf, "ORM", "default")
+    broker = get_shared_broker()
+    assert broker.__class__.__name__ == "ORM"
+    assert get_shared_broker() is broker
+    assert get_shared_broker("shared_test") is not broker
+    assert get_shared_broker("shared_test") is get_shared_broker("shared_test")
+    # a different broker type gets its own instance
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.Broker")
+    assert get_shared_broker().__class__ is Broker
+    monkeypatch.setattr(Conf, "BROKER_CLASS", None)
+    assert get_shared_broker() is broker
+    # a forked process starts with fresh instances
+    monkeypatch.setattr(brokers, "_brokers_pid", -1)
+    assert get_shared_broker() is not broker
+    # brokers that aren't thread safe get an instance for each thread
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.Broker")
+    monkeypatch.setattr(Broker, "thread_safe", False)
+    shared = get_shared_broker()
+    assert get_shared_broker() is shared
+    others = []
+    thread = Thread(target=lambda: others.append(get_shared_broker()))
+    thread.start()
+    thread.join()
+    assert others[0] is not shared
+
+
+def test_memory(monkeypatch):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    # check broker
+    broker = get_broker(list_key="memory_test")
+    assert broker.ping() is True
+    assert broker.info() is not None
+    # brokers share the queue with copies sent to other processes
+    assert pickle.loads(pickle.dumps(broker)).connection._id == broker.connection._id
+    # clear before we start
+    broker.delete_queue()
+    # async_task
+    broker.enqueue("test")
+    assert broker.queue_size() == 1
+    # dequeue
+    task = broker.dequeue()[0]
+    assert task[1] == "test"
+    broker.acknowledge(task[0])
+    assert broker.queue_size() == 0
+    # Retry test
+    monkeypatch.setattr(Conf, "RETRY", 1)
+    broker.enqueue("test")
+    assert broker.queue_size() == 1
+    broker.dequeue()
+    assert broker.queue_size() == 0
+    sleep(1.5)
+    assert broker.queue_size() == 1
+    task = broker.dequeue()[0]
+    assert broker.queue_size() == 0
+    broker.acknowledge(task[0])
+    sleep(1.5)
+    assert broker.queue_size() == 0
+    # delete job
+    task_id = broker.enqueue("test")
+    broker.delete(task_id)
+    assert broker.dequeue() is None
+    # fail
+    task_id = broker.enqueue("test")
+    broker.fail(task_id)
+    # bulk test
+    broker.enqueue_many(["test"] * 5)
+    monkeypatch.setattr(Conf, "BULK", 5)
+    tasks = broker.dequeue()
+    assert broker.lock_size() == Conf.BULK
+    for task in tasks:
+        assert task is not None
+        broker.acknowledge(task[0])
+    # test lock size
+    assert broker.lock_size() == 0
+    # test duplicate acknowledge
+    broker.acknowledge(task[0])
+    # delete queue
+    broker.enqueue("test")
+    broker.enqueue("test")
+    broker.delete_queue()
+    assert broker.queue_size() == 0
+
+
+@pytest.mark.parametrize("returning", [True, False])
+def test_sqlite(monkeypatch, tmp_path, returning):
+    from django_q.brokers import sqlite
+
+    monkeypatch.setattr(Conf, "SQLITE", str(tmp_path / "queue.sqlite3"))
+    monkeypatch.setattr(sqlite, "HAS_RETURNING", returning)
+    # check broker
+    broker = get_broker(list_key="sqlite_test")
+    assert isinstance(broker, sqlite.SQLite)
+    assert broker.ping() is True
+    assert broker.info() is not None
+    assert broker.get_connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    # async_task
+    broker.enqueue("test")
+    assert broker.queue_size() == 1
+    # dequeue
+    task = broker.dequeue()[0]
+    assert task[1] == "test"
+    broker.acknowledge(task[0])
+    assert broker.queue_size() == 0
+    # Retry test
+    monkeypatch.setattr(Conf, "RETRY", 1)
+    broker.enqueue("test")
+    assert broker.queue_size() == 1
+    broker.dequeue()
+    assert broker.queue_size() == 0
+    sleep(1.5)
+    assert broker.queue_size() == 1
+    task = broker.dequeue()[0]
+    assert broker.queue_size() == 0
+    broker.acknowledge(task[0])
+    sleep(1.5)
+    assert broker.queue_size() == 0
+    # delete job
+    task_id = broker.enqueue("test")
+    broker.delete(task_id)
+    assert broker.dequeue() is None
+    # fail
+    task_id = broker.enqueue("test")
+    broker.fail(task_id)
+    # bulk test
+    task_ids = broker.enqueue_many([f"test{i}" for i in range(5)])
+    monkeypatch.setattr(Conf, "BULK", 5)
+    tasks = broker.dequeue()
+    assert [task[0] for task in tasks] == task_ids
+    assert broker.lock_size() == Conf.BULK
+    for task in tasks:
+        assert task is not None
+        broker.acknowledge(task[0])
+    # test lock size
+    assert broker.lock_size() == 0
+    # test duplicate acknowledge
+    broker.acknowledge(task[0])
+    # queues don't mix
+    other = get_broker(list_key="sqlite_other")
+    other.enqueue("other")
+    assert broker.queue_size() == 0
+    # delete queue
+    broker.enqueue("test")
+    broker.enqueue("test")
+    broker.delete_queue()
+    assert broker.queue_size() == 0
+    assert other.queue_size() == 1
+
+
+@pytest.mark.skipif(
+    not os.getenv("DJANGO_Q_BENCHMARK"), reason="set DJANGO_Q_BENCHMARK to run"
+)
+def test_sqlite_throughput(monkeypatch, tmp_path):
+    monkeypatch.setattr(Conf, "SQLITE", str(tmp_path / "queue.sqlite3"))
+    monkeypatch.setattr(Conf, "BULK", 100)
+    broker = get_broker(list_key="sqlite_bench")
+    start = time()
+    broker.enqueue_many(["test"] * 5000)
+    claimed = 0
+    while claimed < 5000:
+        tasks = broker.dequeue()
+        for task_id, _ in tasks:
+            broker.acknowledge(task_id)
+        claimed += len(tasks)
+    # thousands of tasks per second
+    assert time() - start < 5
+    assert broker.queue_size() == 0
+    assert broker.lock_size() == 0
+
+
+def test_sqs_enqueue_failures(monkeypatch):
+    moto = pytest.importorskip("moto")
+    from botocore.exceptions import ClientError
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(Conf, "SQS", {"aws_region": "us-east-1"})
+    with moto.mock_sqs():
+        broker = get_broker(list_key="sqs_failures_test")
+        send_messages = broker.queue.send_messages
+        attempts = []
+
+        def fail_first(Entries, sender_fault=False):
+            attempts.append(len(Entries))
+            if len(attempts) > 1 and not sender_fault:
+                return send_messages(Entries=Entries)
+            # SQS fails part of a batch now and then
+            response = send_messages(Entries=Entries[1:])
+            response["Failed"] = [
+                {"Id": Entries[0]["Id"], "SenderFault": sender_fault, "Code": "Error"}
+            ]
+            return response
+
+        monkeypatch.setattr(broker.queue, "send_messages", fail_first)
+        ids = broker.enqueue_many(["test1", "test2", "test3"])
+        # only the failed message is sent again
+        assert attempts == [3, 1]
+        assert all(ids)
+        assert len(set(ids)) == 3
+        # sender faults fail again, so they raise right away
+        attempts.clear()
+        monkeypatch.setattr(
+            broker.queue, "send_messages", partial(fail_first, sender_fault=True)
+        )
+        with pytest.raises(ClientError):
+            async_many("math.copysign", [(1, -1), (2, -1)], broker=broker)
+        assert attempts == [2]
+        broker.delete_queue()
+
+
+def test_sqs_batch_acknowledge(monkeypatch):
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(Conf, "SQS", {"aws_region": "us-east-1"})
+    monkeypatch.setattr(Conf, "FLUSH_INTERVAL", 60)
+    with moto.mock_sqs():
+        broker = get_broker(list_key="sqs_test")
+        assert broker.info() is not None
+        # count the api calls
+        calls = []
+        broker.sqs.meta.client.meta.events.register(
+            "before-call.sqs.*",
+            lambda model, **kwargs: calls.append(model.name),
+        )
+        broker.enqueue_many([f"test{i}" for i in range(15)])
+        assert calls == ["SendMessageBatch", "SendMessageBatch"]
+        monkeypatch.setattr(Conf, "BULK", 10)
+        tasks = broker.dequeue() + broker.dequeue()
+        assert len(tasks) == 15
+        # acknowledgements are sent in batches of 10
+        calls.clear()
+        for task in tasks:
+            broker.acknowledge(task[0])
+        assert calls == ["DeleteMessageBatch"]
+        assert len(broker._acks) == 5
+        broker.flush()
+        assert calls == ["DeleteMessageBatch", "DeleteMessageBatch"]
+        assert broker._acks == []
+        # queue metrics reuse the attributes
+        calls.clear()
+        assert broker.queue_size() == 0
+        assert broker.lock_size() == 0
+        assert calls == ["GetQueueAttributes"]
+        # the time threshold flushes on acknowledge
+        monkeypatch.setattr(Conf, "FLUSH_INTERVAL", 0)
+        broker.enqueue("test")
+        task = broker.dequeue()[0]
+        broker.acknowledge(task[0])
+        assert broker._acks == []
+        assert broker.dequeue() is None
+        # delete and fail
+        broker.enqueue("test")
+        task = broker.dequeue()[0]
+        broker.delete(task[0])
+        broker.enqueue("test")
+        task = broker.dequeue()[0]
+        broker.fail(task[0])
+        # not buffered
+        assert broker._acks == []
+        broker._attributes = None
+        assert broker.queue_size() == 0
+        assert broker.lock_size() == 0
+        broker.delete_queue()
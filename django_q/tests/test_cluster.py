@@ -1,34 +1,59 @@
+import asyncio
+import gc
 import os
+import signal
 import sys
 import threading
 import uuid as uuidlib
+from datetime import timedelta
 from math import copysign
-from multiprocessing import Event, Value
-from time import sleep
+from multiprocessing import Array, Event, Process, Value
+from time import sleep, time
 from typing import Optional
 
 import pytest
+from django import db
+from django.db.models.signals import post_save
 from django.utils import timezone
 
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, myPath + "/../")
 
+from django_q import core_signing
 from django_q.brokers import Broker, get_broker
-from django_q.cluster import Cluster, Sentinel, monitor, pusher, save_task, worker
+from django_q.cluster import (
+    TIMEOUT_GRACE,
+    Cluster,
+    Sentinel,
+    TimerDeadlines,
+    async_worker,
+    locate,
+    monitor,
+    prune,
+    pusher,
+    save_task,
+    shard,
+    thread_worker,
+    worker,
+)
 from django_q.conf import Conf
 from django_q.humanhash import DEFAULT_WORDLIST, uuid
-from django_q.models import Success, Task
+from django_q.models import Failure, Success, Task
 from django_q.queues import Queue
 from django_q.signals import post_execute, pre_enqueue, pre_execute
 from django_q.status import Stat
 from django_q.tasks import (
+    async_many,
     async_task,
+    async_task_async,
     count_group,
     delete_group,
     fetch,
+    fetch_async,
     fetch_group,
     queue_size,
     result,
+    result_async,
     result_group,
 )
 from django_q.tests.tasks import TaskError, multiply
@@ -48,6 +73,39 @@ def broker(monkeypatch):
     return get_broker()
 
 
+def task_package(func, args=(), **options):
+    """
+    Builds a task package like the pusher puts on the task queue
+    """
+    tag = uuid()
+    task = {
+        "id": tag[1],
+        "name": tag[0],
+        "func": func,
+        "args": args,
+        "kwargs": {},
+        "started": timezone.now(),
+    }
+    task.update(options)
+    return task
+
+
+def run_cluster(broker):
+    """
+    Runs the queued tasks of the broker through a pusher, a worker and a monitor
+    """
+    task_queue = Queue()
+    result_queue = Queue()
+    event = Event()
+    event.set()
+    pusher(task_queue, event, broker)
+    task_queue.put("STOP")
+    worker(task_queue, result_queue, Value("f", -1))
+    result_queue.put("STOP")
+    monitor(result_queue, broker=broker)
+    db.connection.close()
+
+
 def test_redis_connection(broker):
     assert broker.ping() is True
 
@@ -136,6 +194,492 @@ def test_cluster(broker):
     broker.delete_queue()
 
 
+@pytest.mark.django_db
+def test_cluster_memory(monkeypatch):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    broker = get_broker("cluster_memory_test")
+    broker.delete_queue()
+    tasks = async_many(
+        "django_q.tests.tasks.multiply", [(i, 2) for i in range(1, 6)], broker=broker
+    )
+    assert broker.queue_size() == 5
+    task_queue = Queue()
+    result_queue = Queue()
+    event = Event()
+    event.set()
+    # push from another process
+    monkeypatch.setattr(Conf, "BULK", 5)
+    p = Process(target=pusher, args=(task_queue, event, broker))
+    p.start()
+    p.join()
+    assert task_queue.qsize() == 5
+    assert broker.queue_size() == 0
+    assert broker.lock_size() == 5
+    task_queue.put("STOP")
+    worker(task_queue, result_queue, Value("f", -1))
+    result_queue.put("STOP")
+    monitor(result_queue, broker=broker)
+    assert broker.lock_size() == 0
+    assert [result(task) for task in tasks] == [i * 2 for i in range(1, 6)]
+    broker.delete_queue()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_client(monkeypatch):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    broker = get_broker("async_client_test")
+    broker.delete_queue()
+    lookups = []
+    get_result = Task.get_result
+
+    def counted(task_id):
+        lookups.append(task_id)
+        return get_result(task_id)
+
+    monkeypatch.setattr(Task, "get_result", counted)
+
+    async def client():
+        task_id = await async_task_async(
+            "django_q.tests.tasks.multiply", 3, 2, broker=broker
+        )
+        assert broker.queue_size() == 1
+        assert await result_async(task_id) is None
+        # the cluster saves the result while we wait
+        threading.Timer(0.2, run_cluster, args=[broker]).start()
+        lookups.clear()
+        assert await result_async(task_id, wait=5000, broker=broker) == 6
+        # woken by the monitor instead of polling the database
+        assert len(lookups) < 5
+        task = await fetch_async(task_id, broker=broker)
+        assert task.success is True
+        # doesn't block the loop while it waits
+        gaps = []
+
+        async def tick():
+            while True:
+                start = time()
+                await asyncio.sleep(0.01)
+                gaps.append(time() - start)
+
+        ticker = asyncio.ensure_future(tick())
+        waits = [result_async(uuid()[1], wait=300) for _ in range(100)]
+        assert await asyncio.gather(*waits) == [None] * 100
+        ticker.cancel()
+        assert max(gaps) < 0.2
+
+    asyncio.run(client())
+    broker.delete_queue()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_result_notify(monkeypatch):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    monkeypatch.setattr(Conf, "BULK", 2)
+    # a queue of its own, so only passing the broker gets the notifications
+    broker = get_broker("result_notify_test")
+    broker.delete_queue()
+    group_id = uuid()[1]
+    async_task("django_q.tests.tasks.multiply", 4, 2, group=group_id, broker=broker)
+    task_id = async_task("django_q.tests.tasks.multiply", 3, 2, broker=broker)
+    lookups = []
+    get_result = Task.get_result
+
+    def counted(task_id):
+        lookups.append(task_id)
+        return get_result(task_id)
+
+    monkeypatch.setattr(Task, "get_result", counted)
+
+    threading.Timer(0.5, run_cluster, args=[broker]).start()
+    start = time()
+    assert result(task_id, wait=5000, broker=broker) == 6
+    assert time() - start < 2
+    # woken by the monitor instead of polling the database
+    assert len(lookups) < 5
+    assert list(result_group(group_id, count=1, wait=1000, broker=broker)) == [8]
+    broker.delete_queue()
+
+
+@pytest.mark.django_db
+def test_prefetch_pusher(monkeypatch):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    monkeypatch.setattr(Conf, "PUSHER_THREADS", 2)
+    monkeypatch.setattr(Conf, "QUEUE_LIMIT", 4)
+    broker = get_broker("prefetch_pusher_test")
+    broker.delete_queue()
+    async_many(
+        "django_q.tests.tasks.multiply", [(i, 2) for i in range(10)], broker=broker
+    )
+    task_queue = Queue()
+    event = Event()
+    thread = threading.Thread(target=pusher, args=(task_queue, event, broker))
+    thread.start()
+    try:
+        sleep(0.5)
+        # fetching pauses at the queue limit
+        assert task_queue.qsize() <= 4 + Conf.PUSHER_THREADS
+        assert broker.queue_size() > 0
+        tasks = []
+        while len(tasks) < 10:
+            tasks.append(task_queue.get(timeout=2))
+    finally:
+        event.set()
+        thread.join()
+    assert sorted(task["args"][0] for task in tasks) == list(range(10))
+    assert all(task["ack_id"] for task in tasks)
+    assert task_queue.qsize() == 0
+    assert broker.queue_size() == 0
+    assert broker.lock_size() == 10
+    broker.delete_queue()
+
+
+class RawSerializer:
+    def dumps(self, obj):
+        return obj
+
+
+@pytest.mark.django_db
+def test_defer_unpack(monkeypatch):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    monkeypatch.setattr(Conf, "DEFER_UNPACK", True)
+    monkeypatch.setattr(Conf, "BULK", 10)
+    broker = get_broker("defer_unpack_test")
+    broker.delete_queue()
+    tasks = async_many(
+        "django_q.tests.tasks.multiply", [(i, 2) for i in range(1, 4)], broker=broker
+    )
+    # a signed package that can't be unpickled
+    broker.enqueue(
+        core_signing.dumps(
+            b"not a pickle",
+            key=Conf.SECRET_KEY,
+            salt=Conf.PREFIX,
+            serializer=RawSerializer,
+        )
+    )
+    task_queue = Queue()
+    result_queue = Queue()
+    event = Event()
+    event.set()
+    pusher(task_queue, event, broker=broker)
+    assert task_queue.qsize() == 4
+    # the pusher only checks the signature
+    task = task_queue.get()
+    assert set(task) == {"package", "ack_id"}
+    task_queue.put(task)
+    task_queue.put("STOP")
+    worker(task_queue, result_queue, Value("f", -1))
+    assert result_queue.qsize() == 4
+    result_queue.put("STOP")
+    monitor(result_queue, broker=broker)
+    # the broken package failed, the rest got acknowledged
+    assert broker.lock_size() == 0
+    assert broker.queue_size() == 0
+    assert [result(task) for task in tasks] == [2, 4, 6]
+    broker.delete_queue()
+
+
+hooked = []
+
+
+def record_hook(task):
+    hooked.append((task.id, task.success))
+
+
+@pytest.mark.django_db
+def test_monitor_batch(monkeypatch, django_assert_max_num_queries):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    monkeypatch.setattr(Conf, "MONITOR_BATCH", 10)
+    monkeypatch.setattr(Conf, "BULK", 10)
+    broker = get_broker("monitor_batch_test")
+    broker.delete_queue()
+    tasks = async_many(
+        "django_q.tests.tasks.multiply",
+        [(i, 2) for i in range(1, 6)],
+        hook="django_q.tests.test_cluster.record_hook",
+        broker=broker,
+    )
+    task_queue = Queue()
+    result_queue = Queue()
+    event = Event()
+    event.set()
+    pusher(task_queue, event, broker=broker)
+    task_queue.put("STOP")
+    worker(task_queue, result_queue, Value("f", -1))
+    results = [result_queue.get() for _ in tasks]
+    # an earlier failed attempt of the first task
+    result_queue.put(dict(results[0], success=False, result="failed"))
+    for task in results:
+        result_queue.put(task)
+    result_queue.put("STOP")
+    executed = []
+
+    def handler(sender, task, **kwargs):
+        executed.append(task["id"])
+
+    saved = []
+
+    def strict(sender, instance, created, raw, using, update_fields, **kwargs):
+        saved.append(instance.id)
+
+    def broken(sender, **kwargs):
+        raise TaskError("receiver failed")
+
+    post_execute.connect(handler)
+    post_save.connect(strict, sender=Task)
+    post_save.connect(broken, sender=Task)
+    hooked.clear()
+    try:
+        with django_assert_max_num_queries(15):
+            monitor(result_queue, broker=broker)
+    finally:
+        post_execute.disconnect(handler)
+        post_save.disconnect(strict, sender=Task)
+        post_save.disconnect(broken, sender=Task)
+    # receivers get Django's arguments, and their errors don't stop the monitor
+    assert len(saved) == 6
+    assert broker.lock_size() == 0
+    assert [result(task) for task in tasks] == [2, 4, 6, 8, 10]
+    # the retry updated the failed attempt
+    assert Task.objects.get(id=tasks[0]).attempt_count == 2
+    # hooks and signals fire for every result
+    assert len(executed) == 6
+    assert hooked[0] == (tasks[0], False)
+    assert sorted(hooked[1:]) == sorted((task, True) for task in tasks)
+    broker.delete_queue()
+
+
+@pytest.mark.django_db
+def test_sharded_results():
+    result_queues = [Queue(), Queue(), Queue()]
+    task_queue = Queue()
+    tasks = []
+    for i in range(12):
+        task = task_package("django_q.tests.tasks.multiply", (i, 2))
+        tasks.append(task)
+        task_queue.put(task)
+    # a retry of the first task
+    task_queue.put(dict(tasks[0]))
+    task_queue.put("STOP")
+    worker(task_queue, result_queues, Value("f", -1))
+    assert sum(q.qsize() for q in result_queues) == 13
+    for q in result_queues:
+        while not q.empty():
+            task = q.get()
+            # all results of a task go to the same queue
+            assert shard(result_queues, task["id"]) is q
+    assert shard(result_queues[0], tasks[0]["id"]) is result_queues[0]
+
+
+@pytest.mark.django_db
+def test_locate_cache(monkeypatch):
+    monkeypatch.setattr(
+        Conf, "PRELOAD", ["django_q.tests.tasks.multiply", "django_q.tests.nope"]
+    )
+    locate.cache_clear()
+    task_queue = Queue()
+    result_queue = Queue()
+    for i in range(3):
+        task_queue.put(task_package("django_q.tests.tasks.multiply", (i, 2)))
+    task_queue.put("STOP")
+    worker(task_queue, result_queue, Value("f", -1))
+    assert [result_queue.get()["result"] for _ in range(3)] == [0, 2, 4]
+    # preloaded once, then resolved from the cache
+    info = locate.cache_info()
+    assert info.misses == 2
+    assert info.hits == 3
+    assert locate("django_q.tests.tasks.multiply") is multiply
+    # paths that don't resolve are tried again, like during a deploy
+    assert info.currsize == 1
+    assert locate("django_q.tests.tasks.late") is None
+    monkeypatch.setattr("django_q.tests.tasks.late", multiply, raising=False)
+    assert locate("django_q.tests.tasks.late") is multiply
+
+
+@pytest.mark.django_db
+def test_sentinel_preload(monkeypatch):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    monkeypatch.setattr(Conf, "PRELOAD", ["django_q.tests.tasks.multiply"])
+    monkeypatch.setattr(Conf, "WORKERS", 1)
+    locate.cache_clear()
+    start_event = Event()
+    stop_event = Event()
+    stop_event.set()
+    try:
+        Sentinel(
+            stop_event,
+            start_event,
+            cluster_id=uuidlib.uuid4(),
+            broker=get_broker("sentinel_preload_test"),
+        )
+        # resolved before the workers were forked
+        assert locate.cache_info().currsize == 1
+        if hasattr(gc, "freeze"):
+            assert gc.get_freeze_count() > 0
+    finally:
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+
+
+@pytest.mark.django_db
+def test_monitors(monkeypatch):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    monkeypatch.setattr(Conf, "MONITORS", 2)
+    monkeypatch.setattr(Conf, "WORKERS", 2)
+    broker = get_broker("monitors_test")
+    broker.delete_queue()
+    async_many(
+        "django_q.tests.tasks.multiply", [(i, 2) for i in range(1, 9)], broker=broker
+    )
+    start_event = Event()
+    stop_event = Event()
+    # set a timer to stop the Sentinel
+    threading.Timer(3, stop_event.set).start()
+    s = Sentinel(stop_event, start_event, cluster_id=uuidlib.uuid4(), broker=broker)
+    assert s.status() == Conf.STOPPED
+    assert len(s.monitors) == 2
+    assert not any(m.is_alive() for m in s.monitors)
+    # the monitors acknowledged every task
+    assert broker.queue_size() == 0
+    assert broker.lock_size() == 0
+    broker.delete_queue()
+
+
+@pytest.mark.django_db
+def test_thread_worker():
+    task_queue = Queue()
+    result_queue = Queue()
+    for i in range(4):
+        task_queue.put(task_package("time.sleep", (0.5,)))
+    task_queue.put("STOP")
+    timer = Array("f", [-1] * 4)
+    start = time()
+    thread_worker(task_queue, result_queue, timer)
+    # the tasks ran at the same time
+    assert time() - start < 1.5
+    results = [result_queue.get() for _ in range(4)]
+    assert all(r["success"] for r in results)
+    assert timer[:] == [-1] * 4
+
+
+def test_thread_worker_slots():
+    task_queue = Queue()
+    result_queue = Queue()
+    task_queue.put(task_package("time.sleep", (0.5,)))
+    task_queue.put(task_package("django_q.tests.tasks.multiply", (3, 2)))
+    task_queue.put("STOP")
+    timer = Array("f", [-1])
+    worker_thread = threading.Thread(
+        target=thread_worker, args=(task_queue, result_queue, timer)
+    )
+    worker_thread.start()
+    sleep(0.2)
+    # the busy worker leaves the next task for other workers
+    assert task_queue.qsize() == 2
+    worker_thread.join()
+    assert [result_queue.get()["success"] for _ in range(2)] == [True, True]
+
+
+@pytest.mark.django_db
+def test_cluster_threads(monkeypatch):
+    monkeypatch.setattr(Conf, "BROKER_CLASS", "django_q.brokers.memory.Memory")
+    monkeypatch.setattr(Conf, "WORKERS", 1)
+    monkeypatch.setattr(Conf, "WORKER_THREADS", 4)
+    broker = get_broker("cluster_threads_test")
+    broker.delete_queue()
+    async_many("time.sleep", [(0.5,)] * 8, broker=broker)
+    start_event = Event()
+    stop_event = Event()
+    # set a timer to stop the Sentinel
+    threading.Timer(3, stop_event.set).start()
+    s = Sentinel(stop_event, start_event, cluster_id=uuidlib.uuid4(), broker=broker)
+    assert s.status() == Conf.STOPPED
+    assert len(s.pool) == 0
+    # eight tasks of half a second ran on a single worker
+    assert broker.queue_size() == 0
+    assert broker.lock_size() == 0
+    broker.delete_queue()
+
+
+@pytest.mark.django_db
+def test_async_worker(monkeypatch):
+    monkeypatch.setattr(Conf, "WORKER_COROUTINES", 10)
+    task_queue = Queue()
+    result_queue = Queue()
+    tasks = [
+        ("django_q.tests.tasks.async_multiply", (i, 2, 0.5), {}) for i in range(1, 9)
+    ]
+    # regular functions run in the executor
+    tasks.append(("django_q.tests.tasks.multiply", (9, 2), {}))
+    tasks.append(("django_q.tests.tasks.async_multiply", (10, 2, 5), {"timeout": 0.5}))
+    for func, args, options in tasks:
+        task_queue.put(task_package(func, args, **options))
+    task_queue.put("STOP")
+    start = time()
+    timer = Value("f", -1)
+    async_worker(task_queue, result_queue, timer)
+    # the tasks ran at the same time
+    assert time() - start < 2
+    assert timer.value == -1
+    results = sorted(
+        (result_queue.get() for _ in range(10)), key=lambda r: r["args"][0]
+    )
+    assert [r["result"] for r in results[:9]] == [i * 2 for i in range(1, 10)]
+    assert all(r["success"] for r in results[:9])
+    assert results[9]["success"] is False
+    assert "timeout" in results[9]["result"]
+
+
+def test_timer_deadlines():
+    timer = Value("f", -1)
+    deadlines = TimerDeadlines(timer)
+    deadlines.start("a", 2)
+    deadlines.start("b", 10)
+    # the earliest deadline plus the grace period
+    assert timer.value == 2 + TIMEOUT_GRACE
+    deadlines.finish("a")
+    assert timer.value == 10 + TIMEOUT_GRACE
+    # tasks without a timeout don't hide the others
+    deadlines.start("c", None)
+    assert timer.value == 10 + TIMEOUT_GRACE
+    deadlines.finish("c")
+    deadlines.finish("b")
+    assert timer.value == -1
+    deadlines.start("d", None)
+    assert timer.value == -1
+    deadlines.finish("d")
+
+
+def test_timer_deadlines_stuck():
+    timer = Value("f", -1)
+    deadlines = TimerDeadlines(timer)
+    deadlines.start("stuck", 1)
+    # a thread that is still running a second after its deadline
+    deadlines.deadlines["stuck"] -= 2
+    deadlines.update()
+    assert timer.value == TIMEOUT_GRACE - 1
+    # a new task doesn't reset the countdown of the stuck one
+    deadlines.start("new", 10)
+    assert timer.value == TIMEOUT_GRACE - 1
+    deadlines.finish("new")
+    # past the grace period the sentinel kills the worker
+    deadlines.deadlines["stuck"] -= TIMEOUT_GRACE
+    deadlines.update()
+    assert timer.value == 0
+
+
+@pytest.mark.django_db
+def test_worker_coroutine():
+    task_queue = Queue()
+    result_queue = Queue()
+    task_queue.put(task_package("django_q.tests.tasks.async_multiply", (3, 2)))
+    task_queue.put("STOP")
+    worker(task_queue, result_queue, Value("f", -1))
+    result = result_queue.get()
+    assert result["success"] is True
+    assert result["result"] == 6
+
+
 @pytest.mark.django_db
 def test_enqueue(broker, admin_user):
     broker.list_key = "cluster_test:q"
@@ -304,6 +848,40 @@ def test_enqueue(broker, admin_user):
     broker.delete_queue()
 
 
+@pytest.mark.django_db
+def test_async_many(monkeypatch):
+    monkeypatch.setattr(Conf, "ORM", "default")
+    broker = get_broker("async_many_test")
+    broker.delete_queue()
+    tasks = async_many("math.copysign", [(1, -1), (2, -1), (3, -1)], broker=broker)
+    assert len(tasks) == 3
+    assert broker.queue_size() == 3
+    task_queue = Queue()
+    stop_event = Event()
+    stop_event.set()
+    pusher(task_queue, stop_event, broker=broker)
+    monkeypatch.setattr(Conf, "BULK", 3)
+    pusher(task_queue, stop_event, broker=broker)
+    assert task_queue.qsize() == 3
+    task_queue.put("STOP")
+    result_queue = Queue()
+    worker(task_queue, result_queue, Value("f", -1))
+    result_queue.put("STOP")
+    monitor(result_queue, broker=broker)
+    assert [result(task) for task in tasks] == [-1, -2, -3]
+    assert broker.queue_size() == 0
+    # sync and q_options
+    tasks = async_many(
+        "math.copysign",
+        [(4, -1), (5, -1)],
+        q_options={"broker": broker, "sync": True, "group": "async_many"},
+    )
+    assert [result(task) for task in tasks] == [-4, -5]
+    assert count_group("async_many") == 2
+    assert async_many("math.copysign", [], broker=broker) == []
+    broker.delete_queue()
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize(
     "cluster_config_timeout, async_task_kwargs",
@@ -369,6 +947,34 @@ def test_timeout_task_finishes(broker, cluster_config_timeout, async_task_kwargs
     broker.delete_queue()
 
 
+@pytest.mark.django_db
+@pytest.mark.skipif(not hasattr(signal, "setitimer"), reason="needs setitimer")
+def test_worker_timeout(monkeypatch):
+    monkeypatch.setattr(Conf, "WORKER_TIMEOUT", True)
+    task_queue = Queue()
+    result_queue = Queue()
+    tasks = [("time.sleep", (5,), {"timeout": 0.5}), ("time.sleep", (0.1,), {})]
+    tasks.append(("django_q.tests.tasks.multiply", (3, 2), {}))
+    # tasks that catch every exception are stopped as well
+    tasks.append(("django_q.tests.tasks.sleep_catch_all", (5,), {"timeout": 0.5}))
+    for func, args, options in tasks:
+        task_queue.put(task_package(func, args, **options))
+    task_queue.put("STOP")
+    timer = Value("f", -1)
+    start = time()
+    worker(task_queue, result_queue, timer, timeout=1)
+    assert time() - start < 2
+    results = [result_queue.get() for _ in range(4)]
+    # stopped inside the worker, which kept going
+    assert results[0]["success"] is False
+    assert "exceeded timeout of 0.5 seconds" in results[0]["result"]
+    assert results[1]["success"] is True
+    assert results[2]["result"] == 6
+    assert results[3]["success"] is False
+    assert "exceeded timeout of 0.5 seconds" in results[3]["result"]
+    assert timer.value == -1
+
+
 @pytest.mark.django_db
 def test_recycle(broker, monkeypatch):
     # set up the Sentinel
@@ -404,6 +1010,7 @@ def test_recycle(broker, monkeypatch):
     result_queue.put("STOP")
     # run monitor
     monitor(result_queue)
+    prune()
     assert Success.objects.count() == Conf.SAVE_LIMIT
     broker.delete_queue()
 
@@ -439,6 +1046,7 @@ def test_max_rss(broker, monkeypatch):
     result_queue.put("STOP")
     # run monitor
     monitor(result_queue)
+    prune()
     assert Success.objects.count() == Conf.SAVE_LIMIT
     broker.delete_queue()
 
@@ -553,6 +1161,37 @@ def test_update_failed(broker):
     assert saved_task.result == "result"
 
 
+@pytest.mark.django_db
+def test_prune(monkeypatch):
+    now = timezone.now()
+    for i in range(5):
+        for success in (True, False):
+            tag = uuid()
+            Task.objects.create(
+                id=tag[1],
+                name=tag[0],
+                func="math.copysign",
+                started=now - timedelta(minutes=i),
+                stopped=now - timedelta(minutes=i),
+                success=success,
+            )
+    # unlimited
+    monkeypatch.setattr(Conf, "SAVE_LIMIT", 0)
+    prune()
+    assert Success.objects.count() == 5
+    # by count
+    monkeypatch.setattr(Conf, "SAVE_LIMIT", 3)
+    prune()
+    assert Success.objects.count() == 3
+    assert Success.objects.last().stopped == now - timedelta(minutes=2)
+    # by age
+    monkeypatch.setattr(Conf, "SAVE_LIMIT_AGE", 90)
+    prune()
+    assert Success.objects.count() == 2
+    # failures are always saved
+    assert Failure.objects.count() == 5
+
+
 @pytest.mark.django_db
 def test_acknowledge_failure_override():
     class VerifyAckMockBroker(Broker):